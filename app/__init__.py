@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Única carga del .env: cualquier módulo del paquete ve la configuración al importarse
+load_dotenv()
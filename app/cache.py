@@ -0,0 +1,229 @@
+"""
+Cache compartida para el estado que no debe duplicarse entre workers.
+
+Se usa para los tickets de acceso de WSAA, el bloqueo de la numeración por
+punto de venta y los resultados de las consultas. El backend se elige con
+``CACHE_BACKEND``:
+
+- ``memoria`` (default): diccionario del proceso, para un único worker.
+- ``sqlite``: base SQLite en modo WAL (``CACHE_SQLITE``), compartida por los
+  procesos del host.
+
+Los valores deben ser serializables a JSON. Un backend nuevo (p. ej. sobre
+Redis o un servicio compatible) solo necesita implementar los métodos
+abstractos de :class:`CacheBackend`:
+
+- ``get``/``set``/``delete``: ``GET``, ``SET ... PX <ttl>`` y ``DEL``.
+- ``compare_and_set``: atómico, con un script Lua (o ``WATCH``/``MULTI``)
+  que compare el valor actual antes de escribir o borrar.
+
+El bloqueo para renovaciones de una sola vez (:meth:`CacheBackend.bloqueo`)
+se construye sobre ``compare_and_set`` y funciona con cualquier backend.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from app.logger_setup import logger
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memoria").lower()
+CACHE_SQLITE = os.getenv("CACHE_SQLITE", "cache_compartida.db")
+# Intervalo de espera (segundos) entre intentos de tomar un bloqueo
+ESPERA_BLOQUEO = 0.05
+
+
+class CacheBackend(ABC):
+    """Interfaz de la cache: valores JSON con vencimiento opcional (``ttl`` en segundos)."""
+
+    @abstractmethod
+    def get(self, clave: str) -> Optional[Any]:
+        """Devuelve el valor de la clave, o None si no existe o está vencida."""
+
+    @abstractmethod
+    def set(self, clave: str, valor: Any, ttl: Optional[float] = None) -> None:
+        """Guarda el valor, reemplazando el anterior."""
+
+    @abstractmethod
+    def delete(self, clave: str) -> None:
+        """Elimina la clave si existe."""
+
+    @abstractmethod
+    def compare_and_set(self, clave: str, esperado: Optional[Any], nuevo: Optional[Any],
+                        ttl: Optional[float] = None) -> bool:
+        """
+        Reemplaza el valor solo si el actual es ``esperado``, de forma atómica.
+
+        Args:
+            clave: Clave a actualizar
+            esperado: Valor actual esperado (None: la clave no existe o está vencida)
+            nuevo: Valor nuevo (None: eliminar la clave)
+            ttl: Vencimiento del valor nuevo en segundos
+
+        Returns:
+            True si el valor se reemplazó
+        """
+
+    @contextmanager
+    def bloqueo(self, clave: str, ttl: float = 60, espera: Optional[float] = None) -> Iterator[None]:
+        """
+        Bloqueo exclusivo sobre una clave, compartido por todos los usuarios de la cache.
+
+        El bloqueo vence a los ``ttl`` segundos aunque quien lo tomó no lo libere
+        (p. ej. si el proceso terminó).
+
+        Args:
+            clave: Clave del bloqueo
+            ttl: Segundos de vigencia del bloqueo
+            espera: Segundos máximos de espera para tomarlo (default: ``ttl``)
+
+        Raises:
+            TimeoutError: Si no se pudo tomar el bloqueo dentro de la espera
+        """
+        token = uuid.uuid4().hex
+        limite = time.monotonic() + (ttl if espera is None else espera)
+        while not self.compare_and_set(clave, None, token, ttl):
+            if time.monotonic() >= limite:
+                raise TimeoutError(f"No se pudo tomar el bloqueo {clave}")
+            time.sleep(ESPERA_BLOQUEO)
+        try:
+            yield
+        finally:
+            self.compare_and_set(clave, token, None)
+
+
+class MemoriaCache(CacheBackend):
+    """Cache en memoria del proceso, segura entre hilos."""
+
+    def __init__(self) -> None:
+        self._datos: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _vigente(self, clave: str) -> Optional[Any]:
+        valor, vence = self._datos.get(clave, (None, None))
+        if vence is not None and vence <= time.time():
+            del self._datos[clave]
+            return None
+        return valor
+
+    def get(self, clave: str) -> Optional[Any]:
+        with self._lock:
+            return self._vigente(clave)
+
+    def set(self, clave: str, valor: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._datos[clave] = (valor, time.time() + ttl if ttl else None)
+
+    def delete(self, clave: str) -> None:
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def compare_and_set(self, clave: str, esperado: Optional[Any], nuevo: Optional[Any],
+                        ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._vigente(clave) != esperado:
+                return False
+            if nuevo is None:
+                self._datos.pop(clave, None)
+            else:
+                self._datos[clave] = (nuevo, time.time() + ttl if ttl else None)
+            return True
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache en una base SQLite en modo WAL, compartida por los procesos del host.
+
+    Cada hilo usa su propia conexión; las escrituras condicionales se hacen
+    dentro de una transacción ``BEGIN IMMEDIATE``.
+
+    Args:
+        path: Archivo de la base
+    """
+
+    def __init__(self, path: str = CACHE_SQLITE) -> None:
+        self.path = path
+        self._local = threading.local()
+        conexion = self._conexion()
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute(
+            "CREATE TABLE IF NOT EXISTS cache (clave TEXT PRIMARY KEY, valor TEXT NOT NULL, vence REAL)"
+        )
+        conexion.execute("CREATE INDEX IF NOT EXISTS cache_vence ON cache (vence)")
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            # autocommit: las transacciones se abren explícitamente
+            conexion = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    @staticmethod
+    def _leer(conexion: sqlite3.Connection, clave: str) -> Optional[Any]:
+        fila = conexion.execute(
+            "SELECT valor FROM cache WHERE clave = ? AND (vence IS NULL OR vence > ?)", (clave, time.time())
+        ).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    @staticmethod
+    def _escribir(conexion: sqlite3.Connection, clave: str, valor: Any, ttl: Optional[float]) -> None:
+        conexion.execute(
+            "INSERT OR REPLACE INTO cache (clave, valor, vence) VALUES (?, ?, ?)",
+            (clave, json.dumps(valor, default=str), time.time() + ttl if ttl else None),
+        )
+
+    def get(self, clave: str) -> Optional[Any]:
+        return self._leer(self._conexion(), clave)
+
+    def set(self, clave: str, valor: Any, ttl: Optional[float] = None) -> None:
+        conexion = self._conexion()
+        # las claves vencidas no se leen, pero se eliminan para que la base no crezca
+        conexion.execute("DELETE FROM cache WHERE vence <= ?", (time.time(),))
+        self._escribir(conexion, clave, valor, ttl)
+
+    def delete(self, clave: str) -> None:
+        self._conexion().execute("DELETE FROM cache WHERE clave = ?", (clave,))
+
+    def compare_and_set(self, clave: str, esperado: Optional[Any], nuevo: Optional[Any],
+                        ttl: Optional[float] = None) -> bool:
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            if self._leer(conexion, clave) != esperado:
+                conexion.execute("ROLLBACK")
+                return False
+            if nuevo is None:
+                conexion.execute("DELETE FROM cache WHERE clave = ?", (clave,))
+            else:
+                self._escribir(conexion, clave, nuevo, ttl)
+            conexion.execute("COMMIT")
+            return True
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+
+_cache: Optional[CacheBackend] = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache() -> CacheBackend:
+    """Devuelve la cache configurada en ``CACHE_BACKEND``, creándola en el primer uso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if CACHE_BACKEND == "sqlite":
+                _cache = SQLiteCache(CACHE_SQLITE)
+            elif CACHE_BACKEND == "memoria":
+                _cache = MemoriaCache()
+            else:
+                raise ValueError(f"CACHE_BACKEND desconocido: {CACHE_BACKEND}")
+            logger.info(f"Cache: {type(_cache).__name__}")
+        return _cache
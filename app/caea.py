@@ -0,0 +1,414 @@
+"""
+Emisión de comprobantes con CAEA (Código de Autorización Electrónico Anticipado).
+
+El CAEA se solicita por quincena antes de que comience el período y se guarda
+en cache. Durante el período los comprobantes se emiten localmente, sin
+llamar a AFIP, y quedan pendientes en un buffer persistente que un hilo en
+segundo plano informa por lotes mediante FECAEARegInformativo.
+
+El buffer es un archivo JSON Lines compartido por los workers del host: toda
+modificación se hace con un lock exclusivo (``fcntl.flock``) sobre
+``<CAEA_PENDIENTES>.lock`` y un solo proceso a la vez, el que toma
+``<CAEA_PENDIENTES>.informador.lock``, informa los comprobantes. Con el mismo
+lock se numeran los comprobantes: el último número emitido por tipo y punto de
+venta se guarda en ``<CAEA_PENDIENTES>.numeros.json``, sin depender de la cache
+(que con el backend ``memoria`` es propia de cada worker).
+"""
+import os
+import json
+import fcntl
+import datetime
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from app.logger_setup import logger
+from app.factura_electronica import (
+    autenticar,
+    conectar_wsfev1,
+    crear_comprobante,
+    completar_resultado,
+    Comprobante,
+)
+
+CAEA_CACHE = os.getenv("CAEA_CACHE", "caea_cache.json")
+CAEA_PENDIENTES = os.getenv("CAEA_PENDIENTES", "caea_pendientes.jsonl")
+# Comprobantes informados por ciclo y segundos entre ciclos del informador
+CAEA_LOTE = int(os.getenv("CAEA_LOTE", 100))
+CAEA_INTERVALO = int(os.getenv("CAEA_INTERVALO", 60))
+# AFIP permite solicitar el CAEA desde 5 días corridos antes del inicio de la quincena
+DIAS_ANTICIPACION = 5
+# Días antes de la fecha tope de información a partir de los cuales se alerta por pendientes
+CAEA_AVISO_DIAS = int(os.getenv("CAEA_AVISO_DIAS", 2))
+
+MODO_CAE = "CAE"
+MODO_CAEA = "CAEA"
+
+
+def _clave_registro(registro: Dict[str, Any]) -> Tuple[int, int, int]:
+    encabezado = registro["encabezado"]
+    return int(encabezado["tipo_cbte"]), int(encabezado["punto_vta"]), int(encabezado["cbte_nro"])
+
+
+def ultimo_emitido(tipo_cbte: int, punto_vta: int) -> int:
+    """Último número emitido con CAEA en el tipo y punto de venta (0 si no se emitió ninguno)."""
+    ruta = f"{CAEA_PENDIENTES}.numeros.json"
+    if not os.path.exists(ruta):
+        return 0
+    # el archivo se reemplaza de forma atómica: se puede leer sin el bloqueo de pendientes
+    with open(ruta, encoding="utf-8") as f:
+        return int(json.load(f).get(f"{int(tipo_cbte)}-{int(punto_vta)}", 0))
+
+
+def periodo_orden(fecha: datetime.date) -> Tuple[int, int]:
+    """Devuelve el período (AAAAMM) y la quincena (1 o 2) de una fecha."""
+    return int(fecha.strftime("%Y%m")), 1 if fecha.day <= 15 else 2
+
+
+class GestorCAEA:
+    """
+    Administra el CAEA vigente, la numeración local y los comprobantes pendientes de informar.
+
+    Args:
+        production: Si es True usa ambiente de producción, sino homologación
+        cache: Archivo JSON con los CAEA obtenidos por período
+        pendientes: Archivo JSON Lines con los comprobantes pendientes de informar
+    """
+
+    def __init__(self, production: bool = False, cache: str = CAEA_CACHE,
+                 pendientes: str = CAEA_PENDIENTES) -> None:
+        self.production = production
+        self.cache_path = cache
+        self.pendientes_path = pendientes
+        self._lock = threading.Lock()
+        self._informar_lock = threading.Lock()
+        self._caeas: Dict[str, Dict[str, Any]] = self._cargar_cache()
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self._vencimientos: Dict[str, Any] = {"estado": "ok", "vencidos": 0, "por_vencer": 0}
+
+    # -- persistencia -----------------------------------------------------
+
+    def _cargar_cache(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _guardar_cache(self) -> None:
+        tmp = f"{self.cache_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._caeas, f)
+        os.replace(tmp, self.cache_path)
+
+    @contextmanager
+    def _bloqueo_pendientes(self) -> Iterator[None]:
+        """Lock exclusivo, entre hilos y procesos, para leer o modificar el buffer de pendientes."""
+        with self._lock, open(f"{self.pendientes_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _cargar_pendientes(self) -> List[Dict[str, Any]]:
+        """Lee el buffer de pendientes (debe llamarse con el bloqueo de pendientes tomado)."""
+        if not os.path.exists(self.pendientes_path):
+            return []
+        with open(self.pendientes_path, encoding="utf-8") as f:
+            return [json.loads(linea) for linea in f if linea.strip()]
+
+    def _quitar_pendientes(self, informados: List[Dict[str, Any]]) -> int:
+        """
+        Quita del buffer los comprobantes informados, conservando los agregados por otros workers.
+
+        Returns:
+            Cantidad de comprobantes que siguen pendientes
+        """
+        claves = {_clave_registro(registro) for registro in informados}
+        with self._bloqueo_pendientes():
+            restantes = [r for r in self._cargar_pendientes() if _clave_registro(r) not in claves]
+            tmp = f"{self.pendientes_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for registro in restantes:
+                    f.write(json.dumps(registro, default=str) + "\n")
+            os.replace(tmp, self.pendientes_path)
+        return len(restantes)
+
+    def _cargar_numeros(self) -> Dict[str, int]:
+        """Último número emitido por tipo y punto de venta (debe llamarse con el bloqueo de pendientes tomado)."""
+        ruta = f"{self.pendientes_path}.numeros.json"
+        if not os.path.exists(ruta):
+            return {}
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _guardar_numeros(self, numeros: Dict[str, int]) -> None:
+        ruta = f"{self.pendientes_path}.numeros.json"
+        with open(f"{ruta}.tmp", "w", encoding="utf-8") as f:
+            json.dump(numeros, f)
+        os.replace(f"{ruta}.tmp", ruta)
+
+    # -- CAEA -------------------------------------------------------------
+
+    def obtener_caea(self, fecha: Optional[datetime.date] = None) -> Dict[str, Any]:
+        """
+        Devuelve el CAEA de la quincena de ``fecha``, consultándolo o solicitándolo a AFIP si no está en cache.
+
+        Raises:
+            RuntimeError: Si AFIP no otorga el CAEA
+        """
+        periodo, orden = periodo_orden(fecha or datetime.date.today())
+        clave = f"{periodo}-{orden}"
+        caea = self._caeas.get(clave)
+        if caea:
+            return caea
+
+        logger.info(f"Obteniendo CAEA para período={periodo} orden={orden} ...")
+        wsfev1 = conectar_wsfev1(autenticar(self.production), self.production)
+        # si ya fue solicitado (por otra instancia, o antes de un reinicio) solo se consulta
+        codigo = wsfev1.CAEAConsultar(periodo, orden)
+        if not codigo:
+            codigo = wsfev1.CAEASolicitar(periodo, orden)
+        if not codigo:
+            logger.error(f"Error de AFIP al solicitar CAEA: {wsfev1.ErrMsg}")
+            raise RuntimeError(wsfev1.ErrMsg or f"AFIP no otorgó CAEA para {clave}")
+
+        caea = {
+            "caea": str(codigo),
+            "periodo": periodo,
+            "orden": orden,
+            "fch_vig_desde": wsfev1.FchVigDesde,
+            "fch_vig_hasta": wsfev1.FchVigHasta,
+            "fch_tope_inf": wsfev1.FchTopeInf,
+        }
+        with self._lock:
+            self._caeas[clave] = caea
+            self._guardar_cache()
+        logger.info(f"CAEA obtenido: {caea}")
+        return caea
+
+    def siguiente_numero(self, tipo_cbte: int, punto_vta: int, registros: List[Dict[str, Any]],
+                         numeros: Dict[str, int]) -> int:
+        """
+        Asigna el próximo número local (debe llamarse con el bloqueo de pendientes tomado).
+
+        Es el siguiente al mayor entre el último emitido, guardado junto al
+        buffer y compartido por los workers del host, y los pendientes de
+        informar. Solo si el punto de venta todavía no emitió con CAEA se toma
+        el último autorizado en AFIP.
+
+        Args:
+            tipo_cbte: Tipo de comprobante
+            punto_vta: Punto de venta
+            registros: Comprobantes pendientes de informar
+            numeros: Último número emitido por tipo y punto de venta
+        """
+        ultimo = max([numeros.get(f"{tipo_cbte}-{punto_vta}", 0)] + [
+            nro for tipo, pto, nro in map(_clave_registro, registros) if (tipo, pto) == (tipo_cbte, punto_vta)
+        ])
+        if not ultimo:
+            wsfev1 = conectar_wsfev1(autenticar(self.production), self.production)
+            ultimo = int(wsfev1.CompUltimoAutorizado(tipo_cbte, punto_vta) or 0)
+        return ultimo + 1
+
+    # -- emisión e informe ------------------------------------------------
+
+    def emitir(self, cbte: Comprobante) -> Dict[str, Any]:
+        """
+        Emite localmente un comprobante con el CAEA vigente y lo deja pendiente de informar.
+
+        Returns:
+            El encabezado del comprobante emitido
+
+        Raises:
+            ValueError: Si el número indicado ya fue emitido y está pendiente de informar
+        """
+        caea = self.obtener_caea()
+        encabezado = cbte.encabezado
+        tipo_cbte, punto_vta = int(encabezado["tipo_cbte"]), int(encabezado["punto_vta"])
+        with self._bloqueo_pendientes():
+            registros = self._cargar_pendientes()
+            numeros = self._cargar_numeros()
+            if not encabezado["cbte_nro"]:
+                encabezado["cbte_nro"] = self.siguiente_numero(tipo_cbte, punto_vta, registros, numeros)
+            elif (tipo_cbte, punto_vta, int(encabezado["cbte_nro"])) in set(map(_clave_registro, registros)):
+                raise ValueError(f"El comprobante nro={encabezado['cbte_nro']} ya fue emitido con CAEA "
+                                 "y está pendiente de informar")
+            encabezado["caea"] = caea["caea"]
+            encabezado["cae"] = caea["caea"]
+            encabezado["fch_venc_cae"] = caea["fch_vig_hasta"]
+            encabezado["resultado"] = "A"
+            encabezado["fecha_hs_gen"] = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+            registro = {
+                "encabezado": dict(encabezado),
+                "ivas": [
+                    {"iva_id": iva["iva_id"], "base_imp": str(iva["base_imp"]), "importe": str(iva["importe"])}
+                    for iva in cbte.ivas.values()
+                ],
+                "cmp_asocs": cbte.cmp_asocs,
+                "fch_tope_inf": caea["fch_tope_inf"],
+            }
+            with open(self.pendientes_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(registro, default=str) + "\n")
+            clave = f"{tipo_cbte}-{punto_vta}"
+            numeros[clave] = max(numeros.get(clave, 0), int(encabezado["cbte_nro"]))
+            self._guardar_numeros(numeros)
+        logger.info(f"Comprobante emitido con CAEA={caea['caea']} nro={encabezado['cbte_nro']}")
+        return encabezado
+
+    def pendientes(self) -> int:
+        """Cantidad de comprobantes pendientes de informar (de todos los workers)."""
+        with self._bloqueo_pendientes():
+            return len(self._cargar_pendientes())
+
+    def informar_pendientes(self, lote: int = CAEA_LOTE) -> int:
+        """
+        Informa a AFIP hasta ``lote`` comprobantes pendientes usando una única conexión.
+
+        Solo informa un proceso a la vez: si otro worker tiene el lock de
+        informador no hace nada. Los comprobantes que AFIP rechaza o que
+        fallan quedan pendientes para el próximo ciclo.
+
+        Returns:
+            Cantidad de comprobantes informados
+        """
+        with self._informar_lock, open(f"{self.pendientes_path}.informador.lock", "a") as informador:
+            try:
+                fcntl.flock(informador, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.debug("Otro worker está informando los comprobantes CAEA")
+                return 0
+            with self._bloqueo_pendientes():
+                registros = self._cargar_pendientes()[:lote]
+            if not registros:
+                return 0
+
+            logger.info(f"Informando {len(registros)} comprobantes CAEA ...")
+            wsfev1 = conectar_wsfev1(autenticar(self.production), self.production)
+            informados = []
+            for registro in registros:
+                cbte = Comprobante(**registro["encabezado"])
+                cbte.cmp_asocs = registro["cmp_asocs"]
+                for iva in registro["ivas"]:
+                    cbte.agregar_iva(iva["iva_id"], Decimal(iva["base_imp"]), Decimal(iva["importe"]))
+                try:
+                    cbte.informar(wsfev1)
+                    informados.append(registro)
+                except Exception as e:
+                    logger.error(f"No se pudo informar el comprobante CAEA nro={registro['encabezado']['cbte_nro']}: {e}")
+
+            restantes = self._quitar_pendientes(informados)
+            logger.info(f"Comprobantes CAEA informados: {len(informados)}, pendientes: {restantes}")
+            return len(informados)
+
+    def controlar_vencimientos(self, hoy: Optional[datetime.date] = None) -> Dict[str, Any]:
+        """
+        Cuenta los pendientes cuya fecha tope de información (``fch_tope_inf``) pasó o está por llegar.
+
+        Registra un error si hay alguno: pasada la fecha tope AFIP ya no acepta
+        el informe del comprobante.
+
+        Returns:
+            Dict con el estado (``ok``, ``por_vencer`` o ``vencido``) y la cantidad de pendientes en cada caso
+        """
+        hoy = hoy or datetime.date.today()
+        aviso = (hoy + datetime.timedelta(days=CAEA_AVISO_DIAS)).strftime("%Y%m%d")
+        topes = {caea["caea"]: caea["fch_tope_inf"] for caea in self._caeas.values()}
+        with self._bloqueo_pendientes():
+            registros = self._cargar_pendientes()
+        vencidos = por_vencer = 0
+        for registro in registros:
+            tope = str(registro.get("fch_tope_inf") or topes.get(registro["encabezado"].get("caea")) or "")
+            if not tope:
+                continue
+            if tope < hoy.strftime("%Y%m%d"):
+                vencidos += 1
+            elif tope <= aviso:
+                por_vencer += 1
+        estado = "vencido" if vencidos else "por_vencer" if por_vencer else "ok"
+        if estado != "ok":
+            logger.error(f"Comprobantes CAEA pendientes de informar con la fecha tope de información "
+                         f"vencida: {vencidos}, por vencer en {CAEA_AVISO_DIAS} días: {por_vencer}")
+        self._vencimientos = {"estado": estado, "vencidos": vencidos, "por_vencer": por_vencer}
+        return self._vencimientos
+
+    def estado(self) -> Dict[str, Any]:
+        """Resultado del último control de vencimientos (no lee el buffer)."""
+        return dict(self._vencimientos)
+
+    def _ciclo(self) -> None:
+        while not self._detener.wait(CAEA_INTERVALO):
+            try:
+                while self.informar_pendientes() == CAEA_LOTE:
+                    pass
+            except Exception as e:
+                logger.error(f"Error al informar comprobantes CAEA: {e}")
+            try:
+                self.controlar_vencimientos()
+            except Exception as e:
+                logger.error(f"Error al controlar los vencimientos de los comprobantes CAEA: {e}")
+            try:
+                # solicitar por adelantado el CAEA de la próxima quincena
+                self.obtener_caea(datetime.date.today() + datetime.timedelta(days=DIAS_ANTICIPACION))
+            except Exception as e:
+                logger.warning(f"No se pudo obtener el CAEA de la próxima quincena: {e}")
+
+    def iniciar(self) -> None:
+        """Inicia el hilo que informa los comprobantes pendientes en segundo plano."""
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._ciclo, name="informador-caea", daemon=True)
+            self._hilo.start()
+
+    def detener(self) -> None:
+        self._detener.set()
+
+
+_gestores: Dict[bool, GestorCAEA] = {}
+_gestores_lock = threading.Lock()
+
+
+def obtener_gestor(production: bool = False) -> GestorCAEA:
+    """Devuelve el gestor CAEA del ambiente, creándolo e iniciando su informador en el primer uso."""
+    with _gestores_lock:
+        gestor = _gestores.get(production)
+        if gestor is None:
+            gestor = GestorCAEA(production)
+            gestor.iniciar()
+            _gestores[production] = gestor
+        return gestor
+
+
+def estado_pendientes(production: bool = False) -> Optional[Dict[str, Any]]:
+    """Último control de vencimientos de los pendientes del ambiente (None si no se emitió con CAEA)."""
+    gestor = _gestores.get(production)
+    return gestor.estado() if gestor is not None else None
+
+
+def facturar_caea(json_data: Dict[str, Any], production: bool = False) -> Dict[str, Any]:
+    """
+    Emite una factura con el CAEA vigente, sin esperar respuesta de AFIP.
+
+    El comprobante se informa luego en segundo plano (FECAEARegInformativo).
+
+    Args:
+        json_data: Datos de la factura
+        production: Si es True usa ambiente de producción, sino homologación
+
+    Returns:
+        Dict con los datos de la factura emitida (``cae`` contiene el CAEA)
+
+    Raises:
+        ValueError: Si faltan datos requeridos
+        RuntimeError: Si no se pudo obtener el CAEA
+    """
+    logger.debug(f"Iniciando facturación CAEA con datos: {json_data}")
+    try:
+        cbte = crear_comprobante(json_data)
+        encabezado = obtener_gestor(production).emitir(cbte)
+        return completar_resultado(json_data, encabezado)
+    except Exception:
+        logger.exception("Error inesperado durante la facturación con CAEA")
+        raise
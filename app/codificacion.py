@@ -0,0 +1,109 @@
+"""
+Formatos de respuesta compactos y compresión.
+
+- Representaciones alternativas a JSON seleccionadas por el header ``Accept``:
+  MessagePack (``application/msgpack``) y CBOR (``application/cbor``), si
+  están instaladas las librerías ``msgpack`` y ``cbor2``.
+- Compresión gzip o zstd (``zstandard``) según ``Accept-Encoding`` para las
+  rutas de consulta, facturación y conciliación. Flask-RESTX arma el cuerpo
+  completo antes de devolverlo, por lo que se comprime de una sola vez.
+"""
+import os
+import gzip
+import datetime
+from decimal import Decimal
+from typing import Any
+
+from flask import Flask, request, make_response
+from flask_restx import Api
+
+from app.logger_setup import logger
+
+MIME_MSGPACK = 'application/msgpack'
+MIME_CBOR = 'application/cbor'
+# Rutas cuyas respuestas se comprimen
+RUTAS_COMPRIMIBLES = (
+    '/api/afipws/consulta_comprobante',
+    '/api/afipws/facturador',
+    '/api/afipws/conciliacion',
+)
+COMPRESION_MINIMA = int(os.getenv('COMPRESION_MINIMA', 1024))
+GZIP_NIVEL = 6
+ZSTD_NIVEL = 3
+
+
+def _convertir(valor: Any) -> Any:
+    """Convierte tipos que los codificadores no soportan (igual que en la salida JSON)."""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    raise TypeError(f'Tipo no serializable: {type(valor).__name__}')
+
+
+def _output_msgpack(data, code, headers=None):
+    import msgpack
+
+    resp = make_response(msgpack.packb(data, default=_convertir, use_bin_type=True), code)
+    resp.headers.extend(headers or {})
+    resp.headers['Content-Type'] = MIME_MSGPACK
+    return resp
+
+
+def _output_cbor(data, code, headers=None):
+    import cbor2
+
+    resp = make_response(cbor2.dumps(data, default=lambda encoder, valor: encoder.encode(_convertir(valor))), code)
+    resp.headers.extend(headers or {})
+    resp.headers['Content-Type'] = MIME_CBOR
+    return resp
+
+
+def _comprimir(data: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=ZSTD_NIVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_NIVEL)
+
+
+def registrar_codificaciones(app: Flask, api: Api) -> None:
+    """
+    Registra las representaciones compactas disponibles y la compresión de respuestas.
+
+    Args:
+        app: La aplicación Flask
+        api: La API Flask-RESTX
+    """
+    for modulo, mediatype, output in (('msgpack', MIME_MSGPACK, _output_msgpack),
+                                      ('cbor2', MIME_CBOR, _output_cbor)):
+        try:
+            __import__(modulo)
+        except ImportError:
+            logger.info(f'{mediatype} no disponible: falta la librería {modulo}')
+            continue
+        api.representation(mediatype)(output)
+
+    encodings = ['gzip']
+    try:
+        import zstandard  # noqa: F401
+        encodings.insert(0, 'zstd')
+    except ImportError:
+        logger.info('Compresión zstd no disponible: falta la librería zstandard')
+
+    @app.after_request
+    def _comprimir_respuesta(response):
+        if not request.path.startswith(RUTAS_COMPRIMIBLES) or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.update(('Accept', 'Accept-Encoding'))
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None or response.is_streamed:
+            return response
+        data = response.get_data()
+        if len(data) < COMPRESION_MINIMA:
+            return response
+        response.set_data(_comprimir(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    logger.info(f'Representaciones: {list(api.representations)}, compresión: {encodings}')
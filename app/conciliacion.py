@@ -0,0 +1,306 @@
+"""
+Conciliación de comprobantes locales contra AFIP.
+
+Recorre los comprobantes autorizados en AFIP desde ``CompUltimoAutorizado``
+hacia atrás, consultándolos en paralelo con un único ticket de acceso, y los
+compara contra el diario local de comprobantes emitidos.
+"""
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+
+from app.logger_setup import logger
+from app.factura_electronica import autenticar, conectar_wsfev1, DIARIO
+
+# Archivo donde se guarda el último número conciliado por tipo y punto de venta
+ESTADO = os.getenv("CONCILIACION_ESTADO", "conciliacion_estado.json")
+WORKERS = int(os.getenv("CONCILIACION_WORKERS", 4))
+# Diferencia máxima aceptada entre importes (redondeo)
+TOLERANCIA_IMPORTE = 0.01
+
+Clave = Tuple[int, int, int]
+
+
+def cargar_diario(path: Optional[str] = None) -> Dict[Clave, Dict[str, Any]]:
+    """
+    Carga el diario local indexado por (tipo_cbte, punto_vta, cbte_nro).
+
+    Args:
+        path: Ruta al diario en formato JSON Lines (por defecto DIARIO)
+
+    Returns:
+        Dict con los registros locales indexados por clave de comprobante
+    """
+    path = path or DIARIO
+    indice: Dict[Clave, Dict[str, Any]] = {}
+    if not path or not os.path.exists(path):
+        logger.warning(f"Diario local no encontrado: {path}")
+        return indice
+    with open(path, encoding="utf-8") as diario:
+        for linea in diario:
+            linea = linea.strip()
+            if not linea:
+                continue
+            registro = json.loads(linea)
+            clave = (int(registro["tipo_cbte"]), int(registro["punto_vta"]), int(registro["cbte_nro"]))
+            # ante registros duplicados prevalece el último
+            indice[clave] = registro
+    logger.info(f"Diario local cargado: {len(indice)} comprobantes")
+    return indice
+
+
+def cargar_estado(path: Optional[str] = None) -> Dict[str, int]:
+    """Carga el último número conciliado por 'tipo-punto_vta'."""
+    path = path or ESTADO
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def guardar_estado(estado: Dict[str, int], path: Optional[str] = None) -> None:
+    """Guarda el último número conciliado por 'tipo-punto_vta'."""
+    path = path or ESTADO
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    os.replace(tmp, path)
+
+
+class ConsultorAFIP:
+    """
+    Consulta comprobantes en paralelo compartiendo un ticket de acceso.
+
+    Cada hilo usa su propio cliente WSFEv1 (los clientes guardan el estado
+    de la última operación), creado una sola vez y reutilizado.
+    """
+
+    def __init__(self, production: bool = False, workers: int = WORKERS) -> None:
+        self.production = production
+        self.workers = workers
+        self.ta = autenticar(production)
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="conciliacion")
+
+    def _wsfev1(self):
+        wsfev1 = getattr(self._local, "wsfev1", None)
+        if wsfev1 is None:
+            wsfev1 = conectar_wsfev1(self.ta, self.production)
+            self._local.wsfev1 = wsfev1
+        return wsfev1
+
+    def _ultimo_autorizado(self, tipo_cbte: int, punto_vta: int) -> int:
+        wsfev1 = self._wsfev1()
+        ult = wsfev1.CompUltimoAutorizado(tipo_cbte, punto_vta)
+        if wsfev1.ErrMsg:
+            raise RuntimeError(wsfev1.ErrMsg)
+        return int(ult or 0)
+
+    def ultimo_autorizado(self, tipo_cbte: int, punto_vta: int) -> int:
+        return self._executor.submit(self._ultimo_autorizado, tipo_cbte, punto_vta).result()
+
+    def _consultar(self, clave: Clave) -> Optional[Dict[str, Any]]:
+        wsfev1 = self._wsfev1()
+        wsfev1.CompConsultar(*clave)
+        if wsfev1.ErrMsg:
+            if "602:" in wsfev1.ErrMsg:
+                return None
+            raise RuntimeError(wsfev1.ErrMsg)
+        return dict(wsfev1.factura)
+
+    def consultar(self, claves: Iterable[Clave]) -> List[Optional[Dict[str, Any]]]:
+        """Consulta un lote de comprobantes, preservando el orden."""
+        return list(self._executor.map(self._consultar, claves))
+
+    def cerrar(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def recorrer_afip(consultor: ConsultorAFIP, tipo_cbte: int, punto_vta: int,
+                  fecha_desde: str, fecha_hasta: str,
+                  desde_nro: int = 0) -> Tuple[int, Dict[int, Dict[str, Any]], List[int], int, int]:
+    """
+    Recorre hacia atrás los comprobantes de AFIP de un tipo y punto de venta.
+
+    El recorrido se detiene al alcanzar ``desde_nro`` (modo incremental) o el
+    primer comprobante anterior a ``fecha_desde``.
+
+    Returns:
+        Tupla (último autorizado, comprobantes en rango por número,
+        números sin datos en AFIP, menor número revisado, mayor número
+        conciliado: el anterior al primer comprobante posterior a ``fecha_hasta``)
+    """
+    ultimo = consultor.ultimo_autorizado(tipo_cbte, punto_vta)
+    encontrados: Dict[int, Dict[str, Any]] = {}
+    inexistentes: List[int] = []
+    lote = consultor.workers * 4
+    nro = ultimo
+    minimo = ultimo + 1
+    conciliado = ultimo
+    while nro > desde_nro:
+        numeros = list(range(nro, max(nro - lote, desde_nro), -1))
+        facturas = consultor.consultar((tipo_cbte, punto_vta, n) for n in numeros)
+        fin = False
+        for n, factura in zip(numeros, facturas):
+            if factura is None:
+                inexistentes.append(n)
+                continue
+            fecha = str(factura.get("fecha_cbte") or "")
+            if fecha < fecha_desde:
+                fin = True
+                continue
+            minimo = min(minimo, n)
+            if fecha <= fecha_hasta:
+                encontrados[n] = factura
+            else:
+                # no se compara: una conciliación incremental posterior debe revisarlo
+                conciliado = min(conciliado, n - 1)
+        if fin:
+            break
+        minimo = min(minimo, numeros[-1])
+        nro = numeros[-1] - 1
+    logger.info(f"AFIP tipo={tipo_cbte} pto_vta={punto_vta}: ultimo={ultimo}, "
+                f"revisados={ultimo - minimo + 1}, en rango={len(encontrados)}")
+    return ultimo, encontrados, inexistentes, minimo, conciliado
+
+
+def comparar(tipo_cbte: int, punto_vta: int, afip: Dict[int, Dict[str, Any]],
+             indice: Dict[Clave, Dict[str, Any]], fecha_desde: str, fecha_hasta: str,
+             desde_nro: int, minimo: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Compara los comprobantes de AFIP contra el diario local indexado."""
+    resultado: Dict[str, List[Dict[str, Any]]] = {
+        "faltantes_local": [],
+        "faltantes_afip": [],
+        "diferencias_total": [],
+        "sin_cae": [],
+    }
+    for nro, factura in sorted(afip.items()):
+        local = indice.get((tipo_cbte, punto_vta, nro))
+        ref = {"tipo_cbte": tipo_cbte, "punto_vta": punto_vta, "cbte_nro": nro}
+        if local is None:
+            resultado["faltantes_local"].append({**ref, "imp_total": factura.get("imp_total"), "cae": factura.get("cae")})
+            continue
+        total_afip = float(factura.get("imp_total") or 0)
+        total_local = float(local.get("imp_total") or 0)
+        if abs(total_afip - total_local) > TOLERANCIA_IMPORTE:
+            resultado["diferencias_total"].append({**ref, "imp_total_afip": total_afip, "imp_total_local": total_local})
+        if not local.get("cae") or str(local["cae"]) != str(factura.get("cae")):
+            resultado["sin_cae"].append({**ref, "cae_afip": factura.get("cae"), "cae_local": local.get("cae")})
+
+    # comprobantes locales del período que AFIP no tiene autorizados
+    for (tipo, pto, nro), local in indice.items():
+        if tipo != tipo_cbte or pto != punto_vta or nro <= desde_nro or nro in afip:
+            continue
+        fecha = str(local.get("fecha_cbte") or "")
+        if fecha_desde <= fecha <= fecha_hasta and nro >= minimo:
+            resultado["faltantes_afip"].append({"tipo_cbte": tipo, "punto_vta": pto, "cbte_nro": nro,
+                                                "imp_total": local.get("imp_total"), "cae": local.get("cae")})
+    resultado["faltantes_afip"].sort(key=lambda r: r["cbte_nro"])
+    return resultado
+
+
+def validar_parametros(fecha_desde: Any, fecha_hasta: Any, puntos_venta: Any) -> None:
+    """
+    Valida los parámetros de la conciliación antes de consultar AFIP.
+
+    Raises:
+        ValueError: Si falta un parámetro o tiene formato inválido
+    """
+    for nombre, fecha in (("fecha_desde", fecha_desde), ("fecha_hasta", fecha_hasta)):
+        if not isinstance(fecha, str) or len(fecha) != 8 or not fecha.isdigit():
+            raise ValueError(f"{nombre} es requerido con formato AAAAMMDD")
+    if fecha_desde > fecha_hasta:
+        raise ValueError("fecha_desde no puede ser posterior a fecha_hasta")
+    if not isinstance(puntos_venta, list) or not puntos_venta or \
+            not all(isinstance(p, int) and not isinstance(p, bool) for p in puntos_venta):
+        raise ValueError("puntos_venta es requerido como lista de enteros")
+
+
+def conciliar(fecha_desde: str, fecha_hasta: str, puntos_venta: List[int],
+              tipos_cbte: Optional[List[int]] = None, incremental: bool = False,
+              production: bool = False, diario: Optional[str] = None,
+              estado: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Concilia el diario local contra los comprobantes autorizados en AFIP.
+
+    Args:
+        fecha_desde: Fecha inicial (AAAAMMDD)
+        fecha_hasta: Fecha final (AAAAMMDD)
+        puntos_venta: Puntos de venta a conciliar
+        tipos_cbte: Tipos de comprobante (por defecto los presentes en el diario)
+        incremental: Si es True solo revisa números posteriores a la última conciliación
+            (todos, aunque sean anteriores a ``fecha_desde``)
+        production: Si es True usa ambiente de producción, sino homologación
+        diario: Ruta al diario local (por defecto DIARIO_COMPROBANTES)
+        estado: Ruta al archivo de estado incremental (por defecto CONCILIACION_ESTADO)
+
+    Returns:
+        Dict con faltantes en el diario local, faltantes en AFIP,
+        diferencias de importe total, comprobantes sin CAE (o con CAE distinto)
+        y números sin datos en AFIP (huecos en la numeración)
+
+    Raises:
+        ValueError: Si las fechas o los puntos de venta son inválidos
+    """
+    validar_parametros(fecha_desde, fecha_hasta, puntos_venta)
+    logger.info(f"Iniciando conciliación: {fecha_desde}-{fecha_hasta}, ptos_vta={puntos_venta}, incremental={incremental}")
+    indice = cargar_diario(diario)
+    if not tipos_cbte:
+        tipos_cbte = sorted({tipo for tipo, pto, _ in indice if pto in puntos_venta})
+    ultimos = cargar_estado(estado) if incremental else {}
+
+    reporte: Dict[str, Any] = {
+        "fecha_desde": fecha_desde,
+        "fecha_hasta": fecha_hasta,
+        "comprobantes_revisados": 0,
+        "faltantes_local": [],
+        "faltantes_afip": [],
+        "diferencias_total": [],
+        "sin_cae": [],
+        "sin_datos_afip": [],
+        "ultimos_autorizados": {},
+    }
+    consultor = ConsultorAFIP(production)
+    try:
+        for punto_vta in puntos_venta:
+            for tipo_cbte in tipos_cbte:
+                clave = f"{tipo_cbte}-{punto_vta}"
+                desde_nro = int(ultimos.get(clave, 0))
+                # con estado previo se revisan todos los números posteriores, sin importar
+                # fecha_desde: si no, los anteriores a fecha_desde quedarían conciliados sin compararse
+                inicio = "" if desde_nro else fecha_desde
+                ultimo, afip, inexistentes, minimo, conciliado = recorrer_afip(
+                    consultor, tipo_cbte, punto_vta, inicio, fecha_hasta, desde_nro
+                )
+                if inexistentes:
+                    logger.warning(f"Números sin datos en AFIP para {clave}: {inexistentes}")
+                    reporte["sin_datos_afip"].extend(
+                        {"tipo_cbte": tipo_cbte, "punto_vta": punto_vta, "cbte_nro": n} for n in sorted(inexistentes)
+                    )
+                parcial = comparar(tipo_cbte, punto_vta, afip, indice,
+                                   inicio, fecha_hasta, desde_nro, minimo)
+                for key, items in parcial.items():
+                    reporte[key].extend(items)
+                reporte["comprobantes_revisados"] += len(afip)
+                reporte["ultimos_autorizados"][clave] = ultimo
+                ultimos[clave] = max(conciliado, desde_nro)
+    finally:
+        consultor.cerrar()
+
+    if incremental:
+        guardar_estado(ultimos, estado)
+    logger.info(f"Conciliación finalizada: revisados={reporte['comprobantes_revisados']}, "
+                f"faltantes_local={len(reporte['faltantes_local'])}, faltantes_afip={len(reporte['faltantes_afip'])}, "
+                f"diferencias_total={len(reporte['diferencias_total'])}, sin_cae={len(reporte['sin_cae'])}")
+    return reporte
+
+
+if __name__ == "__main__":
+    import sys
+    import datetime
+
+    hoy = datetime.date.today().strftime("%Y%m%d")
+    puntos = [int(p) for p in sys.argv[1:]] or [4000]
+    print(json.dumps(conciliar(hoy, hoy, puntos, incremental=True), indent=2, default=str))
@@ -9,10 +9,9 @@
 # WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTIBILITY
 # or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
 # for more details.
-from pyafipws.wsaa import WSAA
-from pyafipws.wsfev1 import WSFEv1
-
 from app.logger_setup import logger
+from app.limitador import ClienteLimitado, LimiteExcedido, admision, espera_restante
+from app.cache import obtener_cache
 
 "Ejemplo completo para WSFEv1 de AFIP (Factura Electrónica Mercado Interno)"
 
@@ -21,18 +20,22 @@ __copyright__ = "Copyright (C) 2010 - 2019 Mariano Reingart"
 __license__ = "GPL 3.0"
 
 import os
+import json
 import datetime
 import warnings
-from dotenv import load_dotenv
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Iterator, TYPE_CHECKING
 from decimal import Decimal
 import http.client as http_client
 import logging
+from contextlib import ExitStack, contextmanager
 
-http_client.HTTPConnection.debuglevel = 1
-logging.getLogger('urllib3').setLevel(logging.DEBUG)
+if TYPE_CHECKING:
+    from pyafipws.wsfev1 import WSFEv1
 
-load_dotenv()
+# Trazas HTTP completas de las llamadas SOAP (solo para depuración)
+if os.getenv("AFIP_HTTP_DEBUG", "FALSE").upper() == "TRUE":
+    http_client.HTTPConnection.debuglevel = 1
+    logging.getLogger('urllib3').setLevel(logging.DEBUG)
 
 URL_WSAA_HOMO = "https://wsaahomo.afip.gov.ar/ws/services/LoginCms?wsdl"
 URL_WSAA_PROD = "https://wsaa.afip.gov.ar/ws/services/LoginCms?wsdl"
@@ -46,25 +49,287 @@ PRIVATEKEY = os.getenv("PRIVATEKEY")
 logger.info(f'privatekey={PRIVATEKEY}')
 CACHE = ""
 # CACHE = "cache"
+# Diario local de comprobantes autorizados (JSON Lines), usado por la conciliación
+DIARIO = os.getenv("DIARIO_COMPROBANTES")
+# Estado del último ticket de acceso obtenido (para el chequeo de salud)
+_ticket: Dict[str, Any] = {"vencimiento": None, "error": None}
+# Segundos antes del vencimiento en que el ticket de acceso se deja de usar y se renueva
+TICKET_MARGEN = int(os.getenv("TICKET_MARGEN", 300))
+# Segundos que un proceso puede demorar la renovación del ticket antes de que otro la intente
+TICKET_RENOVACION = 60
+# Segundos que se reutiliza el resultado de una consulta de comprobante encontrado
+CONSULTA_TTL = int(os.getenv("CONSULTA_TTL", 300))
+# Timeout de cada llamada SOAP a WSFEv1
+TIMEOUT_SOAP = 30
+# Segundos que un proceso puede retener la numeración de un punto de venta mientras AFIP
+# autoriza: mayor que las dos llamadas SOAP que se hacen con la numeración bloqueada
+NUMERACION_BLOQUEO = 3 * TIMEOUT_SOAP
+# Segundos sugeridos para reintentar cuando la numeración del punto de venta está ocupada
+NUMERACION_REINTENTO = 1
+
+
+def _ambiente(production: bool) -> str:
+    return "produccion" if production else "homologacion"
+
+
+def _segundos_hasta(vencimiento: Optional[str]) -> Optional[float]:
+    """Segundos que faltan para un vencimiento ISO 8601 de WSAA (None si no se puede interpretar)."""
+    try:
+        return (datetime.datetime.fromisoformat(vencimiento) - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return None
 
 
-def facturar(json_data: Dict[str, Any], production: bool = False) -> Dict[str, Any]:
+def _pyafipws(production: bool = False):
     """
-    Emite facturas electrónicas con CAE AFIP Argentina
-    
+    Importa pyafipws en el primer uso: es costoso y no se necesita para iniciar el servicio.
+
+    Con AFIP_REPLAY se usan clientes que responden desde un cassette grabado y
+    con AFIP_GRABAR se graban las llamadas reales (ver :mod:`app.replay`).
+    Ninguno de los dos se admite en producción.
+
     Args:
-        json_data: Datos de la factura
         production: Si es True usa ambiente de producción, sino homologación
-        
+
+    Raises:
+        RuntimeError: Si AFIP_REPLAY o AFIP_GRABAR están definidos en producción
+    """
+    replay = os.getenv("AFIP_REPLAY")
+    grabar = os.getenv("AFIP_GRABAR")
+    if production and (replay or grabar):
+        raise RuntimeError("AFIP_REPLAY y AFIP_GRABAR son solo para homologación: no se usan con PRODUCTION")
+    if replay:
+        from app.replay import clientes_replay
+        return clientes_replay(replay)
+    from pyafipws.wsaa import WSAA
+    from pyafipws.wsfev1 import WSFEv1
+    if grabar:
+        from app.replay import clientes_grabadores
+        return clientes_grabadores(WSAA, WSFEv1, grabar)
+    return WSAA, WSFEv1
+
+
+def autenticar(production: bool = False) -> str:
+    """
+    Obtiene un ticket de acceso (TA) de WSAA para el servicio wsfe.
+
+    El ticket se guarda en la cache compartida hasta poco antes de su
+    vencimiento; si hay que renovarlo, un solo proceso llama a WSAA y el
+    resto espera y usa el ticket obtenido.
+
+    Args:
+        production: Si es True usa ambiente de producción, sino homologación
+
     Returns:
-        Dict con los datos de la factura autorizada
-    
+        El ticket de acceso en formato XML
+    """
+    cache = obtener_cache()
+    clave = f"ta:{CUIT}:{_ambiente(production)}"
+    ticket = cache.get(clave)
+    if ticket is None:
+        with cache.bloqueo(f"{clave}:renovacion", ttl=TICKET_RENOVACION):
+            # otro proceso pudo haberlo renovado mientras se esperaba el bloqueo
+            ticket = cache.get(clave)
+            if ticket is None:
+                ticket = _solicitar_ticket(production)
+                vigencia = _segundos_hasta(ticket["vencimiento"])
+                if vigencia and vigencia > TICKET_MARGEN:
+                    cache.set(clave, ticket, ttl=vigencia - TICKET_MARGEN)
+    _ticket["vencimiento"] = ticket["vencimiento"]
+    _ticket["error"] = None
+    return ticket["ta"]
+
+
+def _solicitar_ticket(production: bool) -> Dict[str, Any]:
+    """Solicita un ticket de acceso nuevo a WSAA."""
+    URL_WSAA = URL_WSAA_PROD if production else URL_WSAA_HOMO
+    logger.info(f"Usando URL WSAA: {URL_WSAA}")
+    WSAA, _ = _pyafipws(production)
+    wsaa = WSAA()
+    logger.info("autenticando ...")
+    try:
+        ta = wsaa.Autenticar(
+            "wsfe", CERT, PRIVATEKEY, wsdl=URL_WSAA, cache=CACHE, debug=True
+        )
+        logger.info(f"Token de acceso obtenido: {ta}")
+        return {"ta": ta, "vencimiento": wsaa.ObtenerTagXml("expirationTime")}
+    except Exception as auth_error:
+        logger.error(f"Error en autenticación: {str(auth_error)}")
+        _ticket["error"] = str(auth_error)
+        raise
+
+
+def estado_ticket() -> Dict[str, Any]:
+    """Devuelve el vencimiento del último ticket de acceso y el último error de autenticación."""
+    return dict(_ticket)
+
+
+def estado_servidores(wsfev1: "WSFEv1") -> Dict[str, str]:
+    """
+    Consulta el estado de los servidores de AFIP (FEDummy, no requiere ticket de acceso).
+
+    Args:
+        wsfev1: Cliente WSFEv1 conectado
+
+    Returns:
+        Dict con el estado de los servidores de aplicación, base de datos y autenticación
+    """
+    wsfev1.Dummy()
+    return {
+        "app": wsfev1.AppServerStatus,
+        "db": wsfev1.DbServerStatus,
+        "auth": wsfev1.AuthServerStatus,
+    }
+
+
+def conectar_wsfev1(ta: Optional[str], production: bool = False) -> "WSFEv1":
+    """
+    Crea un cliente WSFEv1 conectado usando un ticket de acceso ya obtenido.
+
+    Cada cliente guarda el estado de la última operación (``ErrMsg``,
+    ``factura``, etc.), por lo que no debe compartirse entre hilos; el
+    ticket de acceso sí puede compartirse.
+
+    Args:
+        ta: Ticket de acceso devuelto por :func:`autenticar` (None para
+            operaciones que no lo requieren, como FEDummy)
+        production: Si es True usa ambiente de producción, sino homologación
+
+    Returns:
+        Cliente WSFEv1 listo para operar, con límite de tasa en las llamadas a AFIP
+    """
+    URL_WSFEv1 = URL_WSFEv1_PROD if production else URL_WSFEv1_HOMO
+    logger.info(f"Usando URL WSFEv1: {URL_WSFEv1}")
+    _, WSFEv1 = _pyafipws(production)
+    wsfev1 = WSFEv1()
+    logger.info("asignando cuit ... ")
+    wsfev1.Cuit = CUIT
+    if ta:
+        logger.info("asignando ticket de acceso ...")
+        wsfev1.SetTicketAcceso(ta)
+    logger.info("conectando ...")
+    wsfev1.Conectar(CACHE, URL_WSFEv1, timeout=TIMEOUT_SOAP)
+    logger.info("... conectado")
+    # las llamadas a AFIP respetan el límite de tasa por CUIT y operación
+    return ClienteLimitado(wsfev1, CUIT)
+
+
+def _clave_numero(tipo_cbte: int, punto_vta: int, production: bool) -> str:
+    return f"nro:{CUIT}:{_ambiente(production)}:{int(tipo_cbte)}:{int(punto_vta)}"
+
+
+@contextmanager
+def bloquear_numeracion(tipo_cbte: int, punto_vta: int, production: bool = False) -> Iterator[None]:
+    """
+    Bloquea la numeración de un tipo y punto de venta entre hilos y procesos.
+
+    Dentro de una admisión se espera el bloqueo a lo sumo lo que le queda a
+    la solicitud (ver :func:`app.limitador.espera_restante`).
+
     Raises:
-        ValueError: Si faltan datos requeridos
-        RuntimeError: Si hay error en la comunicación con AFIP
+        LimiteExcedido: Si la numeración sigue ocupada al vencer la espera
     """
-    logger.debug(f"Iniciando facturación con datos: {json_data}")
+    clave = f"{_clave_numero(tipo_cbte, punto_vta, production)}:autorizacion"
+    with ExitStack() as bloqueo:
+        try:
+            bloqueo.enter_context(obtener_cache().bloqueo(clave, ttl=NUMERACION_BLOQUEO, espera=espera_restante()))
+        except TimeoutError:
+            logger.warning(f"Numeración ocupada: {clave}")
+            raise LimiteExcedido("FECAESolicitar", NUMERACION_REINTENTO) from None
+        yield
+
+
+def siguiente_numero(tipo_cbte: int, punto_vta: int, ultimo_autorizado: Callable[[], Any]) -> int:
+    """
+    Devuelve el próximo número de comprobante a autorizar con CAE.
+
+    Debe llamarse con la numeración del punto de venta bloqueada (ver
+    :meth:`Comprobante.autorizar`). El último autorizado se consulta a AFIP en
+    cada llamada: así no se repiten números entre workers que no comparten la
+    cache ni con comprobantes autorizados por fuera del servicio. Tampoco se
+    reutilizan los números emitidos con CAEA pendientes de informar.
+
+    Args:
+        tipo_cbte: Tipo de comprobante
+        punto_vta: Punto de venta
+        ultimo_autorizado: Función que devuelve el último número autorizado en AFIP
+
+    Returns:
+        El número a autorizar
+    """
+    from app.caea import ultimo_emitido  # app.caea importa este módulo
+
+    return max(int(ultimo_autorizado() or 0), ultimo_emitido(tipo_cbte, punto_vta)) + 1
+
 
+def registrar_en_diario(encabezado: Dict[str, Any]) -> None:
+    """
+    Agrega un comprobante autorizado al diario local (si está configurado).
+
+    Args:
+        encabezado: Encabezado del comprobante autorizado
+    """
+    if not DIARIO:
+        return
+    registro = {
+        "tipo_cbte": encabezado["tipo_cbte"],
+        "punto_vta": encabezado["punto_vta"],
+        "cbte_nro": encabezado["cbte_nro"],
+        "fecha_cbte": encabezado["fecha_cbte"],
+        "imp_total": float(encabezado["imp_total"]),
+        "cae": encabezado["cae"],
+    }
+    try:
+        with open(DIARIO, "a", encoding="utf-8") as diario:
+            diario.write(json.dumps(registro) + "\n")
+    except OSError as e:
+        # el comprobante ya fue autorizado: no hacer fallar la facturación
+        logger.error(f"Error al registrar comprobante en el diario {DIARIO}: {e}")
+
+
+# Campos numéricos de la factura (los opcionales pueden ser null)
+CAMPOS_ENTEROS = ("tipo_afip", "punto_venta", "tipo_documento", "id_condicion_iva", "nro",
+                  "asociado_tipo_afip", "asociado_punto_venta", "asociado_numero_comprobante")
+CAMPOS_IMPORTES = ("total", "neto", "iva", "neto105", "iva105")
+CAMPOS_OPCIONALES = ("nro", "neto", "iva", "neto105", "iva105",
+                     "asociado_tipo_afip", "asociado_punto_venta", "asociado_numero_comprobante")
+
+
+def _validar_tipos(json_data: Dict[str, Any]) -> None:
+    """
+    Verifica que los campos numéricos de la factura lo sean.
+
+    Raises:
+        ValueError: Si algún campo tiene un tipo inválido
+    """
+    def valido(campo: str, tipos: tuple) -> bool:
+        valor = json_data.get(campo)
+        if valor is None:
+            return campo in CAMPOS_OPCIONALES
+        return isinstance(valor, tipos) and not isinstance(valor, bool)
+
+    invalidos = [campo for campo in CAMPOS_ENTEROS if not valido(campo, (int,))]
+    invalidos += [campo for campo in CAMPOS_IMPORTES if not valido(campo, (int, float))]
+    if not valido("documento", (int, str)):
+        invalidos.append("documento")
+    if invalidos:
+        logger.error(f"Campos con tipo inválido: {invalidos}")
+        raise ValueError(f"Campos con tipo inválido: {invalidos}")
+
+
+def crear_comprobante(json_data: Dict[str, Any]) -> "Comprobante":
+    """
+    Valida los datos de la factura y arma el comprobante a autorizar.
+
+    Args:
+        json_data: Datos de la factura
+
+    Returns:
+        Comprobante con IVAs y comprobante asociado agregados
+
+    Raises:
+        ValueError: Si faltan datos requeridos o tienen un tipo inválido
+    """
     # Validar datos requeridos
     required_fields = ['tipo_afip', 
                        'punto_venta', 
@@ -76,75 +341,83 @@ def facturar(json_data: Dict[str, Any], production: bool = False) -> Dict[str, A
         missing_fields = [field for field in required_fields if field not in json_data]
         logger.error(f"Faltan campos requeridos: {missing_fields}")
         raise ValueError(f"Faltan campos requeridos: {missing_fields}")
+    _validar_tipos(json_data)
+
+    hoy = datetime.date.today().strftime("%Y%m%d")
+    logger.info("creando comprobante ...")
+    cbte = Comprobante(
+        tipo_cbte=json_data.get("tipo_afip"),
+        punto_vta=json_data.get("punto_venta"),
+        fecha_cbte=hoy,
+        cbte_nro=json_data.get("nro"),
+        tipo_doc=json_data.get("tipo_documento"),
+        nro_doc=json_data.get("documento"),
+        imp_total=json_data.get("total"),
+        imp_neto=round(json_data.get("neto", 0) + json_data.get("neto105", 0), 2),
+        imp_iva=round(json_data.get("iva", 0) + json_data.get("iva105", 0), 2),
+        asociado_tipo_afip=json_data.get("asociado_tipo_afip", None),
+        asociado_punto_venta=json_data.get("asociado_punto_venta", None),
+        asociado_numero_comprobante=json_data.get("asociado_numero_comprobante", None),
+        asociado_fecha_comprobante=json_data.get("asociado_fecha_comprobante", None),
+        condicion_iva_receptor_id=json_data.get("id_condicion_iva", None),
+    )
+    neto = json_data.get("neto") or 0
+    iva = json_data.get("iva") or 0
+    neto105 = json_data.get("neto105") or 0
+    iva105 = json_data.get("iva105") or 0
+    if iva > 0:
+        logger.info("agregando iva 21 ...")
+        cbte.agregar_iva(5, neto, iva)
+    if iva105 > 0:
+        logger.info("agregando iva 10.5 ...")
+        cbte.agregar_iva(4, neto105, iva105)
+    if not cbte.encabezado["asociado_numero_comprobante"] is None:
+        cbte.agregar_asociado()
+    return cbte
+
+
+def completar_resultado(json_data: Dict[str, Any], encabezado: Dict[str, Any]) -> Dict[str, Any]:
+    """Agrega a los datos de la factura el resultado de la autorización."""
+    json_data["cae"] = encabezado["cae"]
+    json_data["vencimiento_cae"] = encabezado["fch_venc_cae"]
+    json_data["resultado"] = encabezado["resultado"]
+    json_data["numero_comprobante"] = encabezado["cbte_nro"]
+    json_data["fecha_comprobante"] = encabezado["fecha_cbte"]
+    registrar_en_diario(encabezado)
+    return json_data
 
-    try:
-        URL_WSAA = URL_WSAA_PROD if production else URL_WSAA_HOMO
-        URL_WSFEv1 = URL_WSFEv1_PROD if production else URL_WSFEv1_HOMO
-        logger.info(f"Usando URLs - WSAA: {URL_WSAA}, WSFEv1: {URL_WSFEv1}")
+
+def facturar(json_data: Dict[str, Any], production: bool = False) -> Dict[str, Any]:
+    """
+    Emite facturas electrónicas con CAE AFIP Argentina
+    
+    Args:
+        json_data: Datos de la factura
+        production: Si es True usa ambiente de producción, sino homologación
         
-        # inicialización AFIP:
-        wsaa = WSAA()
-        wsfev1 = WSFEv1()
-        logger.info("autenticando ...")
+    Returns:
+        Dict con los datos de la factura autorizada
+    
+    Raises:
+        ValueError: Si faltan datos requeridos
+        RuntimeError: Si hay error en la comunicación con AFIP
+    """
+    logger.debug(f"Iniciando facturación con datos: {json_data}")
 
-        # Agregar más logging para debug
-        try:
-            ta = wsaa.Autenticar(
-                "wsfe", CERT, PRIVATEKEY, wsdl=URL_WSAA, cache=CACHE, debug=True
-            )
-            logger.info(f"Token de acceso obtenido: {ta}")
-        except Exception as auth_error:
-            logger.error(f"Error en autenticación: {str(auth_error)}")
-            raise
+    try:
+        # recorrer los json_data a facturar, solicitar CAE y generar el PDF:
+        cbte = crear_comprobante(json_data)
 
-        logger.info("asignando cuit ... ")
-        wsfev1.Cuit = CUIT
-        logger.info("asignando ticket de acceso ...")
-        wsfev1.SetTicketAcceso(ta)
-        logger.info("conectando ...")
-        wsfev1.Conectar(CACHE, URL_WSFEv1)
-        logger.info("... conectado")
+        ta = autenticar(production)
+        wsfev1 = conectar_wsfev1(ta, production)
 
-        # recorrer los json_data a facturar, solicitar CAE y generar el PDF:
-        hoy = datetime.date.today().strftime("%Y%m%d")
-        logger.info("creando comprobante ...")
-        cbte = Comprobante(
-            tipo_cbte=json_data.get("tipo_afip"),
-            punto_vta=json_data.get("punto_venta"),
-            fecha_cbte=hoy,
-            cbte_nro=json_data.get("nro"),
-            tipo_doc=json_data.get("tipo_documento"),
-            nro_doc=json_data.get("documento"),
-            imp_total=json_data.get("total"),
-            imp_neto=round(json_data.get("neto", 0) + json_data.get("neto105", 0), 2),
-            imp_iva=round(json_data.get("iva", 0) + json_data.get("iva105", 0), 2),
-            asociado_tipo_afip=json_data.get("asociado_tipo_afip", None),
-            asociado_punto_venta=json_data.get("asociado_punto_venta", None),
-            asociado_numero_comprobante=json_data.get("asociado_numero_comprobante", None),
-            asociado_fecha_comprobante=json_data.get("asociado_fecha_comprobante", None),
-            condicion_iva_receptor_id=json_data.get("id_condicion_iva", None),
-        )
-        neto = json_data.get("neto")
-        iva = json_data.get("iva")
-        neto105 = json_data.get("neto105")
-        iva105 = json_data.get("iva105")
-        if iva > 0:
-            logger.info("agregando iva 21 ...")
-            cbte.agregar_iva(5, neto, iva)
-        if iva105 > 0:
-            logger.info("agregando iva 10.5 ...")
-            cbte.agregar_iva(4, neto105, iva105)
-        if not cbte.encabezado["asociado_numero_comprobante"] is None:
-            cbte.agregar_asociado()
-        logger.info("autorizando comprobante ...")
-        ok = cbte.autorizar(wsfev1)
+        # una sola admisión por solicitud, antes de asignar el número
+        with admision(CUIT, "FECAESolicitar"):
+            logger.info("autorizando comprobante ...")
+            ok = cbte.autorizar(wsfev1, production)
         nro = cbte.encabezado["cbte_nro"]
         logger.info(f"factura autorizada={nro} cae={cbte.encabezado['cae']}")
-        json_data["cae"] = cbte.encabezado["cae"]
-        json_data["vencimiento_cae"] = cbte.encabezado["fch_venc_cae"]
-        json_data["resultado"] = cbte.encabezado["resultado"]
-        json_data["numero_comprobante"] = cbte.encabezado["cbte_nro"]
-        json_data["fecha_comprobante"] = cbte.encabezado["fecha_cbte"]
+        completar_resultado(json_data, cbte.encabezado)
         
         # Logging detallado para debug
         logger.info(f"Resultado final antes de devolver: {json_data}")
@@ -152,6 +425,8 @@ def facturar(json_data: Dict[str, Any], production: bool = False) -> Dict[str, A
         
         return json_data
 
+    except LimiteExcedido:
+        raise
     except Exception as e:
         logger.exception("Error inesperado durante la facturación")
         raise
@@ -175,35 +450,21 @@ def consultar_comprobante(tipo_cbte: int, punto_vta: int, cbte_nro: int, product
     """
     logger.debug(f"Iniciando consulta de comprobante: tipo={tipo_cbte}, pto_vta={punto_vta}, nro={cbte_nro}")
 
-    try:
-        URL_WSAA = URL_WSAA_PROD if production else URL_WSAA_HOMO
-        URL_WSFEv1 = URL_WSFEv1_PROD if production else URL_WSFEv1_HOMO
-        logger.info(f"Usando URLs - WSAA: {URL_WSAA}, WSFEv1: {URL_WSFEv1}")
-
-        # inicialización AFIP:
-        wsaa = WSAA()
-        wsfev1 = WSFEv1()
-        logger.info("autenticando ...")
-
-        try:
-            ta = wsaa.Autenticar(
-                "wsfe", CERT, PRIVATEKEY, wsdl=URL_WSAA, cache=CACHE, debug=True
-            )
-            logger.info(f"Token de acceso obtenido: {ta}")
-        except Exception as auth_error:
-            logger.error(f"Error en autenticación: {str(auth_error)}")
-            raise
+    # un comprobante autorizado no cambia: se reutiliza la consulta reciente de cualquier worker
+    cache = obtener_cache()
+    clave = f"consulta:{CUIT}:{_ambiente(production)}:{tipo_cbte}:{punto_vta}:{cbte_nro}"
+    resultado = cache.get(clave)
+    if resultado is not None:
+        logger.info(f"Consulta obtenida de la cache: {clave}")
+        return resultado
 
-        logger.info("asignando cuit ... ")
-        wsfev1.Cuit = CUIT
-        logger.info("asignando ticket de acceso ...")
-        wsfev1.SetTicketAcceso(ta)
-        logger.info("conectando ...")
-        wsfev1.Conectar(CACHE, URL_WSFEv1)
-        logger.info("... conectado")
+    try:
+        ta = autenticar(production)
+        wsfev1 = conectar_wsfev1(ta, production)
 
         logger.info("consultando comprobante ...")
-        wsfev1.CompConsultar(tipo_cbte, punto_vta, cbte_nro)
+        with admision(CUIT, "FECompConsultar"):
+            wsfev1.CompConsultar(tipo_cbte, punto_vta, cbte_nro)
 
         if wsfev1.ErrMsg:
             # Si el error es que no existe, lo manejamos como un caso de negocio, no un error del sistema.
@@ -219,8 +480,13 @@ def consultar_comprobante(tipo_cbte: int, punto_vta: int, cbte_nro: int, product
             mensaje_afip += f" Observaciones: {wsfev1.Obs}"
 
         logger.info(f"Consulta exitosa: {wsfev1.factura}")
-        return {"mensaje": mensaje_afip, "factura": wsfev1.factura}
+        resultado = {"mensaje": mensaje_afip, "factura": wsfev1.factura}
+        if CONSULTA_TTL:
+            cache.set(clave, resultado, ttl=CONSULTA_TTL)
+        return resultado
 
+    except LimiteExcedido:
+        raise
     except Exception as e:
         logger.exception("Error inesperado durante la consulta del comprobante")
         raise
@@ -311,37 +577,80 @@ class Comprobante:
             }
         )
 
-    def autorizar(self, wsfev1):
+    def autorizar(self, wsfev1, production: bool = False):
         logger.info("Iniciando proceso de autorización")
+        tipo_cbte = self.encabezado["tipo_cbte"]
+        punto_vta = self.encabezado["punto_vta"]
+        autonumerado = not self.encabezado["cbte_nro"]
+        # numeración y autorización en serie por (tipo, punto de venta): AFIP rechaza
+        # números fuera de orden
+        with bloquear_numeracion(tipo_cbte, punto_vta, production):
+            try:
+                # datos generales del comprobante:
+                if autonumerado:
+                    # si no se especifíca nro de comprobante, autonumerar:
+                    self.encabezado["cbte_nro"] = siguiente_numero(
+                        tipo_cbte,
+                        punto_vta,
+                        lambda: wsfev1.CompUltimoAutorizado(tipo_cbte, punto_vta),
+                    )
+                    logger.info(f"Número de comprobante asignado: {self.encabezado['cbte_nro']}")
+
+                self.encabezado["cbt_desde"] = self.encabezado["cbte_nro"]
+                self.encabezado["cbt_hasta"] = self.encabezado["cbte_nro"]
+                logger.info("creando factura ...")
+                wsfev1.CrearFactura(**self.encabezado)
+
+                # agrego un comprobante asociado (solo notas de crédito / débito)
+                logger.info("agregando asociados ...")
+                for cmp_asoc in self.cmp_asocs:
+                    wsfev1.AgregarCmpAsoc(**cmp_asoc)
+
+                # agrego el subtotal por tasa de IVA (iva_id 5: 21%):
+                logger.info("agregandos ivas ...")
+                for iva in self.ivas.values():
+                    wsfev1.AgregarIva(**iva)
+
+                # llamo al websevice para obtener el CAE:
+                logger.info("solicitando ...")
+                wsfev1.CAESolicitar()
+
+                if wsfev1.ErrMsg:
+                    logger.error(f"Error de AFIP: {wsfev1.ErrMsg}")
+                    raise RuntimeError(wsfev1.ErrMsg)
+
+                if wsfev1.Observaciones:
+                    logger.warning(f"Observaciones de AFIP: {wsfev1.Observaciones}")
+
+                assert wsfev1.Resultado == "A"  # Aprobado!
+                assert wsfev1.CAE
+                assert wsfev1.Vencimiento
+
+                self.encabezado["resultado"] = wsfev1.Resultado
+                self.encabezado["cae"] = wsfev1.CAE
+                self.encabezado["fch_venc_cae"] = wsfev1.Vencimiento
+            
+                logger.info(f"Autorización exitosa - CAE: {wsfev1.CAE}, Vencimiento: {wsfev1.Vencimiento}")
+                return True
+            
+            except Exception as e:
+                if not isinstance(e, LimiteExcedido):
+                    logger.exception("Error durante la autorización del comprobante")
+                raise
+
+    def informar(self, wsfev1):
+        """Informa a AFIP un comprobante emitido con CAEA (FECAEARegInformativo)."""
+        logger.info(f"Informando comprobante CAEA nro={self.encabezado['cbte_nro']}")
         try:
-            # datos generales del comprobante:
-            if not self.encabezado["cbte_nro"]:
-                # si no se especifíca nro de comprobante, autonumerar:
-                ult = wsfev1.CompUltimoAutorizado(
-                    self.encabezado["tipo_cbte"], 
-                    self.encabezado["punto_vta"]
-                )
-                self.encabezado["cbte_nro"] = int(ult) + 1
-                logger.info(f"Número de comprobante asignado: {self.encabezado['cbte_nro']}")
-
             self.encabezado["cbt_desde"] = self.encabezado["cbte_nro"]
             self.encabezado["cbt_hasta"] = self.encabezado["cbte_nro"]
-            logger.info("creando factura ...")
             wsfev1.CrearFactura(**self.encabezado)
-
-            # agrego un comprobante asociado (solo notas de crédito / débito)
-            logger.info("agregando asociados ...")
             for cmp_asoc in self.cmp_asocs:
                 wsfev1.AgregarCmpAsoc(**cmp_asoc)
-
-            # agrego el subtotal por tasa de IVA (iva_id 5: 21%):
-            logger.info("agregandos ivas ...")
             for iva in self.ivas.values():
                 wsfev1.AgregarIva(**iva)
 
-            # llamo al websevice para obtener el CAE:
-            logger.info("solicitando ...")
-            wsfev1.CAESolicitar()
+            wsfev1.CAEARegInformativo()
 
             if wsfev1.ErrMsg:
                 logger.error(f"Error de AFIP: {wsfev1.ErrMsg}")
@@ -350,19 +659,14 @@ class Comprobante:
             if wsfev1.Observaciones:
                 logger.warning(f"Observaciones de AFIP: {wsfev1.Observaciones}")
 
-            assert wsfev1.Resultado == "A"  # Aprobado!
-            assert wsfev1.CAE
-            assert wsfev1.Vencimiento
+            if wsfev1.Resultado != "A":
+                raise RuntimeError(f"Comprobante CAEA rechazado: resultado={wsfev1.Resultado}")
 
-            self.encabezado["resultado"] = wsfev1.Resultado
-            self.encabezado["cae"] = wsfev1.CAE
-            self.encabezado["fch_venc_cae"] = wsfev1.Vencimiento
-            
-            logger.info(f"Autorización exitosa - CAE: {wsfev1.CAE}, Vencimiento: {wsfev1.Vencimiento}")
+            logger.info(f"Comprobante CAEA informado - CAEA: {self.encabezado['caea']}")
             return True
-            
+
         except Exception as e:
-            logger.exception("Error durante la autorización del comprobante")
+            logger.exception("Error al informar el comprobante CAEA")
             raise
 
 
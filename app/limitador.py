@@ -0,0 +1,224 @@
+"""
+Limitación de la tasa de llamadas a AFIP.
+
+Un token bucket por (CUIT, operación de AFIP), compartido entre los procesos
+del host: el estado de cada bucket se guarda en un archivo bajo
+``LIMITE_DIRECTORIO`` y se actualiza con un lock exclusivo (``fcntl.flock``).
+
+Si no hay tokens disponibles la llamada se encola (reserva su token y espera)
+siempre que la espera no supere ``LIMITE_ESPERA_MAXIMA``; si la supera se
+rechaza con :class:`LimiteExcedido`, que indica cuándo reintentar.
+
+Las solicitudes al servicio se admiten una sola vez, al inicio, con
+:func:`admision`: toman el token de su operación principal (p. ej.
+FECAESolicitar) antes de asignar un número de comprobante, y las llamadas a
+AFIP que hacen dentro de la admisión no vuelven a esperar. Así una solicitud
+espera como máximo ``LIMITE_ESPERA_MAXIMA`` y no se rechaza a mitad de camino;
+otras esperas de la solicitud (p. ej. la numeración del punto de venta) se
+acotan con :func:`espera_restante`.
+"""
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional
+
+from app.logger_setup import logger
+
+# Llamadas por segundo y ráfaga máxima por operación (LIMITE_TASA_<OPERACION> para una en particular)
+LIMITE_TASA = float(os.getenv("LIMITE_TASA", 5))
+LIMITE_CAPACIDAD = float(os.getenv("LIMITE_CAPACIDAD", 10))
+# Segundos máximos que una llamada puede esperar su turno antes de rechazarse
+LIMITE_ESPERA_MAXIMA = float(os.getenv("LIMITE_ESPERA_MAXIMA", 5))
+LIMITE_DIRECTORIO = os.getenv("LIMITE_DIRECTORIO", os.path.join(tempfile.gettempdir(), "pyafipws-limites"))
+
+# Métodos de pyafipws que generan una llamada a WSFEv1 y su operación en AFIP
+OPERACIONES = {
+    "CAESolicitar": "FECAESolicitar",
+    "CompUltimoAutorizado": "FECompUltimoAutorizado",
+    "CompConsultar": "FECompConsultar",
+    "CAEASolicitar": "FECAEASolicitar",
+    "CAEAConsultar": "FECAEAConsultar",
+    "CAEARegInformativo": "FECAEARegInformativo",
+}
+
+# Marca de los hilos que atienden una solicitud ya admitida
+_admision = threading.local()
+
+
+class LimiteExcedido(Exception):
+    """La llamada a AFIP superaría el límite de tasa dentro de la espera máxima."""
+
+    def __init__(self, operacion: str, retry_after: float) -> None:
+        self.operacion = operacion
+        self.retry_after = retry_after
+        super().__init__(f"Límite de llamadas a AFIP excedido para {operacion}, reintentar en {retry_after:.1f} s")
+
+
+def _config(operacion: str) -> tuple:
+    """
+    Devuelve la tasa y la capacidad del bucket de una operación.
+
+    Raises:
+        ValueError: Si la tasa no es mayor que 0 o la capacidad es menor que 1
+    """
+    clave = operacion.upper()
+    tasa = float(os.getenv(f"LIMITE_TASA_{clave}", LIMITE_TASA))
+    capacidad = float(os.getenv(f"LIMITE_CAPACIDAD_{clave}", LIMITE_CAPACIDAD))
+    if tasa <= 0:
+        raise ValueError(f"LIMITE_TASA_{clave} (o LIMITE_TASA) debe ser mayor que 0: {tasa}")
+    if capacidad < 1:
+        raise ValueError(f"LIMITE_CAPACIDAD_{clave} (o LIMITE_CAPACIDAD) debe ser al menos 1: {capacidad}")
+    return tasa, capacidad
+
+
+# una configuración inválida impide iniciar el servicio
+for _operacion in OPERACIONES.values():
+    _config(_operacion)
+
+
+def adquirir(cuit: Optional[str], operacion: str, espera_maxima: Optional[float] = None) -> float:
+    """
+    Toma un token del bucket (CUIT, operación), esperando su turno si es necesario.
+
+    Args:
+        cuit: CUIT que realiza la llamada
+        operacion: Operación de AFIP (p. ej. FECAESolicitar)
+        espera_maxima: Segundos máximos de espera (por defecto LIMITE_ESPERA_MAXIMA)
+
+    Returns:
+        Segundos esperados
+
+    Raises:
+        LimiteExcedido: Si el turno llega después de la espera máxima
+    """
+    if espera_maxima is None:
+        espera_maxima = LIMITE_ESPERA_MAXIMA
+    tasa, capacidad = _config(operacion)
+    os.makedirs(LIMITE_DIRECTORIO, exist_ok=True)
+    path = os.path.join(LIMITE_DIRECTORIO, f"{cuit or 'sin-cuit'}-{operacion}.json")
+
+    with open(path, "a+", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            contenido = f.read()
+            estado = json.loads(contenido) if contenido else {
+                "tokens": capacidad, "ts": time.time(), "admitidas": 0, "demoradas": 0, "rechazadas": 0,
+            }
+            ahora = time.time()
+            tokens = min(capacidad, estado["tokens"] + (ahora - estado["ts"]) * tasa)
+            # los tokens negativos son turnos ya reservados por llamadas en espera
+            espera = max(0.0, (1 - tokens) / tasa)
+            if espera > espera_maxima:
+                estado["rechazadas"] += 1
+            else:
+                tokens -= 1
+                estado["admitidas"] += 1
+                if espera > 0:
+                    estado["demoradas"] += 1
+            estado["tokens"] = tokens
+            estado["ts"] = ahora
+            f.seek(0)
+            f.truncate()
+            json.dump(estado, f)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    if espera > espera_maxima:
+        logger.warning(f"Llamada a {operacion} rechazada por límite de tasa (turno en {espera:.2f} s)")
+        raise LimiteExcedido(operacion, espera)
+    if espera > 0:
+        logger.info(f"Llamada a {operacion} demorada {espera:.2f} s por límite de tasa")
+        time.sleep(espera)
+    return espera
+
+
+@contextmanager
+def admision(cuit: Optional[str], operacion: str, espera_maxima: Optional[float] = None) -> Iterator[float]:
+    """
+    Admite una solicitud tomando un único token de su operación principal.
+
+    Dentro del bloque, las llamadas de :class:`ClienteLimitado` en el mismo
+    hilo no vuelven a esperar ni pueden rechazarse por el límite de tasa.
+
+    Args:
+        cuit: CUIT que realiza la solicitud
+        operacion: Operación principal de AFIP de la solicitud
+        espera_maxima: Segundos máximos de espera (por defecto LIMITE_ESPERA_MAXIMA)
+
+    Yields:
+        Segundos esperados para la admisión
+
+    Raises:
+        LimiteExcedido: Si el turno llega después de la espera máxima
+    """
+    if espera_maxima is None:
+        espera_maxima = LIMITE_ESPERA_MAXIMA
+    limite = time.monotonic() + espera_maxima
+    espera = adquirir(cuit, operacion, espera_maxima)
+    anterior = getattr(_admision, "activa", False), getattr(_admision, "limite", None)
+    _admision.activa, _admision.limite = True, limite
+    try:
+        yield espera
+    finally:
+        _admision.activa, _admision.limite = anterior
+
+
+def espera_restante() -> Optional[float]:
+    """Segundos que la solicitud admitida en este hilo todavía puede esperar (None fuera de una admisión)."""
+    limite = getattr(_admision, "limite", None)
+    if limite is None:
+        return None
+    return max(0.0, limite - time.monotonic())
+
+
+def metricas() -> Dict[str, Dict[str, Any]]:
+    """Devuelve, por CUIT y operación, las llamadas admitidas, demoradas y rechazadas (de todos los procesos)."""
+    resultado: Dict[str, Dict[str, Any]] = {}
+    if not os.path.isdir(LIMITE_DIRECTORIO):
+        return resultado
+    for nombre in sorted(os.listdir(LIMITE_DIRECTORIO)):
+        if not nombre.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(LIMITE_DIRECTORIO, nombre), encoding="utf-8") as f:
+                estado = json.loads(f.read() or "{}")
+        except (OSError, ValueError):
+            continue
+        resultado[nombre[:-len(".json")]] = {
+            clave: estado.get(clave, 0) for clave in ("admitidas", "demoradas", "rechazadas")
+        }
+    return resultado
+
+
+class ClienteLimitado:
+    """
+    Envuelve un cliente WSFEv1 aplicando el límite de tasa a los métodos que llaman a AFIP.
+
+    Fuera de una :func:`admision` (p. ej. el informe de CAEA en segundo plano o
+    la conciliación) cada llamada toma su token. El resto de los atributos y
+    métodos se delegan sin cambios.
+    """
+
+    def __init__(self, cliente: Any, cuit: Optional[str]) -> None:
+        object.__setattr__(self, "_cliente", cliente)
+        object.__setattr__(self, "_cuit", cuit)
+
+    def __getattr__(self, nombre: str) -> Any:
+        atributo = getattr(self._cliente, nombre)
+        operacion = OPERACIONES.get(nombre)
+        if operacion is None:
+            return atributo
+
+        def limitado(*args, **kwargs):
+            if not getattr(_admision, "activa", False):
+                adquirir(self._cuit, operacion)
+            return atributo(*args, **kwargs)
+        return limitado
+
+    def __setattr__(self, nombre: str, valor: Any) -> None:
+        setattr(self._cliente, nombre, valor)
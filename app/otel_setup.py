@@ -4,32 +4,36 @@ Se integra con el sistema Jaeger + Elasticsearch existente.
 """
 import os
 import logging
-from typing import Optional
-
-from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.instrumentation.logging import LoggingInstrumentor
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from typing import Optional, TYPE_CHECKING
 
 from app.logger_setup import logger
 
-def setup_otel() -> Optional[trace.Tracer]:
+if TYPE_CHECKING:
+    from opentelemetry import trace
+
+# Los módulos de OpenTelemetry se importan solo si está configurado (su importación es costosa)
+_tracer: Optional["trace.Tracer"] = None
+
+def setup_otel() -> Optional["trace.Tracer"]:
     """
     Configura OpenTelemetry para el servicio.
     
     Returns:
         Optional[trace.Tracer]: El tracer configurado o None si no se puede configurar
     """
+    global _tracer
     try:
         otel_endpoint = os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')
         if not otel_endpoint:
             logger.info("OpenTelemetry no configurado - OTEL_EXPORTER_OTLP_ENDPOINT no definido")
             return None
 
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
         # Forzar el endpoint correcto para el exporter HTTP
         otlp_exporter = OTLPSpanExporter(
             endpoint=f"{otel_endpoint}/v1/traces"
@@ -54,6 +58,7 @@ def setup_otel() -> Optional[trace.Tracer]:
         
         # Obtener el tracer
         tracer = trace.get_tracer(__name__)
+        _tracer = tracer
         
         logger.info(f"OpenTelemetry configurado exitosamente con endpoint: {otel_endpoint}/v1/traces")
         return tracer
@@ -70,6 +75,10 @@ def instrument_app(app):
         app: La aplicación Flask a instrumentar
     """
     try:
+        from opentelemetry.instrumentation.flask import FlaskInstrumentor
+        from opentelemetry.instrumentation.requests import RequestsInstrumentor
+        from opentelemetry.instrumentation.logging import LoggingInstrumentor
+
         # Instrumentar Flask
         FlaskInstrumentor().instrument_app(app)
         logger.info("Flask instrumentado con OpenTelemetry")
@@ -88,14 +97,11 @@ def instrument_app(app):
     except Exception as e:
         logger.error(f"Error instrumentando la aplicación: {e}")
 
-def get_tracer() -> Optional[trace.Tracer]:
+def get_tracer() -> Optional["trace.Tracer"]:
     """
     Obtiene el tracer de OpenTelemetry configurado.
     
     Returns:
-        Optional[trace.Tracer]: El tracer configurado o None
+        Optional[trace.Tracer]: El tracer configurado o None si OpenTelemetry no está configurado
     """
-    try:
-        return trace.get_tracer(__name__)
-    except Exception:
-        return None 
\ No newline at end of file
+    return _tracer 
\ No newline at end of file
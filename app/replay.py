@@ -0,0 +1,227 @@
+"""
+Grabación y reproducción de las interacciones con AFIP (WSAA y WSFEv1).
+
+Permite ejecutar el servicio de forma determinística, sin acceso a AFIP ni a
+pyafipws, para pruebas y mediciones de rendimiento:
+
+- ``AFIP_GRABAR=<cassette.json>``: usa los clientes reales de pyafipws y guarda
+  en el cassette cada llamada a AFIP (argumentos, retorno y atributos
+  resultantes del cliente).
+- ``AFIP_REPLAY=<cassette.json>``: reemplaza los clientes de pyafipws por
+  clientes que responden desde el cassette, simulando la demora de AFIP con
+  la latencia grabada en cada interacción o, si se define,
+  ``AFIP_REPLAY_LATENCIA_MS``.
+
+Formato del cassette::
+
+    {"latencia_ms": 0,
+     "interacciones": [
+        {"servicio": "wsfev1", "metodo": "CompUltimoAutorizado", "args": [6, 4000],
+         "retorno": "100", "atributos": {"ErrMsg": ""}, "latencia_ms": 50},
+        {"servicio": "wsfev1", "metodo": "CAESolicitar", "args": [],
+         "solicitud": {"factura": {"tipo_cbte": 6, "cbt_desde": 101, ...},
+                       "ivas": [{"iva_id": 5, "base_imp": 100.0, "importe": 21.0}]},
+         "retorno": "74049145150923", "atributos": {"CAE": "74049145150923", ...}}]}
+
+``CAESolicitar`` y ``CAEARegInformativo`` se identifican además por la
+solicitud armada antes con ``CrearFactura``, ``AgregarIva``, etc.: un
+comprobante distinto del grabado no recibe la respuesta grabada sino un
+error de interacción no grabada.
+
+Si hay varias interacciones para el mismo método y argumentos se responden en
+orden, volviendo a la primera al agotarse.
+"""
+import os
+import json
+import time
+import threading
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.logger_setup import logger
+
+# Métodos de pyafipws que llaman a AFIP (o dependen de su respuesta) y se graban
+METODOS_GRABADOS = {
+    "wsaa": ("Autenticar", "ObtenerTagXml"),
+    "wsfev1": ("Dummy", "CompUltimoAutorizado", "CompConsultar", "CAESolicitar",
+               "CAEASolicitar", "CAEAConsultar", "CAEARegInformativo"),
+}
+# Métodos locales que arman la solicitud y dónde se guarda cada uno en ella
+METODOS_SOLICITUD = {
+    "CrearFactura": "factura",
+    "AgregarIva": "ivas",
+    "AgregarCmpAsoc": "asociados",
+    "AgregarTributo": "tributos",
+    "AgregarOpcional": "opcionales",
+}
+# Métodos que envían a AFIP la solicitud armada
+METODOS_CON_SOLICITUD = ("CAESolicitar", "CAEARegInformativo")
+# Campos de CrearFactura que se envían a AFIP. fecha_cbte es la del día de
+# emisión y no forma parte de la clave, para que el cassette no venza.
+CAMPOS_FACTURA = ("concepto", "tipo_doc", "nro_doc", "tipo_cbte", "punto_vta", "cbt_desde", "cbt_hasta",
+                  "imp_total", "imp_tot_conc", "imp_neto", "imp_iva", "imp_trib", "imp_op_ex",
+                  "fecha_venc_pago", "fecha_serv_desde", "fecha_serv_hasta", "moneda_id", "moneda_ctz",
+                  "condicion_iva_receptor_id", "caea")
+# Atributos del cliente que se guardan después de cada llamada
+ATRIBUTOS = ("ErrMsg", "Obs", "Observaciones", "Resultado", "CAE", "Vencimiento", "factura",
+             "AppServerStatus", "DbServerStatus", "AuthServerStatus", "CAEA", "Periodo", "Orden",
+             "FchVigDesde", "FchVigHasta", "FchTopeInf", "Excepcion")
+# Valores iniciales: pyafipws los limpia al comenzar cada llamada
+ATRIBUTOS_INICIALES = {"ErrMsg": "", "Obs": "", "Observaciones": [], "Excepcion": ""}
+
+
+def _clave(servicio: str, metodo: str, args: Tuple, solicitud: Optional[Dict[str, Any]] = None) -> str:
+    return json.dumps([servicio, metodo, list(args), solicitud or None], sort_keys=True, default=str)
+
+
+def _armar(solicitud: Dict[str, Any], metodo: str, kwargs: Dict[str, Any]) -> None:
+    """Agrega a la solicitud en curso los datos de un método local (CrearFactura la reinicia)."""
+    if metodo == "CrearFactura":
+        solicitud.clear()
+        solicitud["factura"] = {campo: kwargs.get(campo) for campo in CAMPOS_FACTURA}
+    else:
+        solicitud.setdefault(METODOS_SOLICITUD[metodo], []).append(dict(kwargs))
+
+
+class Cassette:
+    """Interacciones grabadas, indexadas por servicio, método y argumentos."""
+
+    def __init__(self, path: str, latencia_ms: Optional[float] = None) -> None:
+        with open(path, encoding="utf-8") as f:
+            datos = json.load(f)
+        if latencia_ms is None and os.getenv("AFIP_REPLAY_LATENCIA_MS"):
+            latencia_ms = float(os.getenv("AFIP_REPLAY_LATENCIA_MS"))
+        # una latencia configurada reemplaza a la grabada en cada interacción
+        self.latencia_forzada = latencia_ms
+        self.latencia_ms = float(datos.get("latencia_ms", 0))
+        self._lock = threading.Lock()
+        self._interacciones: Dict[str, List[Dict[str, Any]]] = {}
+        self._proxima: Dict[str, int] = {}
+        for interaccion in datos["interacciones"]:
+            clave = _clave(interaccion["servicio"], interaccion["metodo"], tuple(interaccion.get("args", [])),
+                           interaccion.get("solicitud"))
+            self._interacciones.setdefault(clave, []).append(interaccion)
+        logger.info(f"Cassette {path}: {len(datos['interacciones'])} interacciones, latencia {self.latencia_forzada} ms")
+
+    def latencia(self, interaccion: Dict[str, Any]) -> float:
+        """Latencia a simular (ms) para una interacción."""
+        if self.latencia_forzada is not None:
+            return self.latencia_forzada
+        return float(interaccion.get("latencia_ms", self.latencia_ms))
+
+    def responder(self, servicio: str, metodo: str, args: Tuple,
+                  solicitud: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        clave = _clave(servicio, metodo, args, solicitud)
+        with self._lock:
+            interacciones = self._interacciones.get(clave)
+            if not interacciones:
+                detalle = f" con solicitud {json.dumps(solicitud, default=str)}" if solicitud else ""
+                raise RuntimeError(f"Interacción no grabada: {servicio}.{metodo}{args}{detalle}")
+            indice = self._proxima.get(clave, 0)
+            self._proxima[clave] = (indice + 1) % len(interacciones)
+        return interacciones[indice]
+
+
+class ClienteReplay:
+    """
+    Cliente de AFIP que responde desde un cassette.
+
+    Las operaciones que arman la solicitud se registran para identificar la
+    interacción que la envía; el resto de las operaciones locales no hacen nada.
+    """
+
+    def __init__(self, servicio: str, cassette: Cassette) -> None:
+        self._servicio = servicio
+        self._cassette = cassette
+        self._solicitud: Dict[str, Any] = {}
+        self.__dict__.update({atributo: None for atributo in ATRIBUTOS})
+        self.__dict__.update(ATRIBUTOS_INICIALES)
+
+    def __getattr__(self, nombre: str) -> Any:
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        if nombre in METODOS_SOLICITUD:
+            def armar(**kwargs):
+                _armar(self._solicitud, nombre, kwargs)
+                return True
+            return armar
+        if nombre not in METODOS_GRABADOS[self._servicio]:
+            # SetTicketAcceso, Conectar, etc.
+            return lambda *args, **kwargs: True
+
+        def reproducir(*args, **kwargs):
+            # los kwargs (URL del WSDL, cache, debug) dependen del ambiente y no forman parte de la clave
+            solicitud = self._solicitud if nombre in METODOS_CON_SOLICITUD else None
+            interaccion = self._cassette.responder(self._servicio, nombre, args, solicitud)
+            latencia_ms = self._cassette.latencia(interaccion)
+            if latencia_ms:
+                time.sleep(latencia_ms / 1000)
+            self.__dict__.update(ATRIBUTOS_INICIALES)
+            self.__dict__.update(interaccion.get("atributos", {}))
+            return interaccion.get("retorno")
+        return reproducir
+
+
+@lru_cache(maxsize=None)
+def _cassette(path: str) -> Cassette:
+    return Cassette(path)
+
+
+def clientes_replay(path: str):
+    """Devuelve clases equivalentes a (WSAA, WSFEv1) que responden desde el cassette."""
+    cassette = _cassette(path)
+    return (lambda: ClienteReplay("wsaa", cassette)), (lambda: ClienteReplay("wsfev1", cassette))
+
+
+class _Grabador:
+    """Envuelve un cliente real de pyafipws y agrega sus llamadas a AFIP al cassette."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, servicio: str, cliente: Any, path: str) -> None:
+        object.__setattr__(self, "_servicio", servicio)
+        object.__setattr__(self, "_cliente", cliente)
+        object.__setattr__(self, "_path", path)
+        object.__setattr__(self, "_solicitud", {})
+
+    def __getattr__(self, nombre: str) -> Any:
+        atributo = getattr(self._cliente, nombre)
+        if nombre in METODOS_SOLICITUD:
+            def armar(**kwargs):
+                _armar(self._solicitud, nombre, kwargs)
+                return atributo(**kwargs)
+            return armar
+        if nombre not in METODOS_GRABADOS[self._servicio]:
+            return atributo
+
+        def grabar(*args, **kwargs):
+            inicio = time.monotonic()
+            retorno = atributo(*args, **kwargs)
+            interaccion = {
+                "servicio": self._servicio,
+                "metodo": nombre,
+                "args": list(args),
+                "retorno": retorno,
+                "atributos": {a: getattr(self._cliente, a) for a in ATRIBUTOS if hasattr(self._cliente, a)},
+                "latencia_ms": round((time.monotonic() - inicio) * 1000),
+            }
+            if nombre in METODOS_CON_SOLICITUD:
+                interaccion["solicitud"] = json.loads(json.dumps(self._solicitud, default=str))
+            with self._lock:
+                datos = {"latencia_ms": 0, "interacciones": []}
+                if os.path.exists(self._path):
+                    with open(self._path, encoding="utf-8") as f:
+                        datos = json.load(f)
+                datos["interacciones"].append(interaccion)
+                with open(self._path, "w", encoding="utf-8") as f:
+                    json.dump(datos, f, indent=2, default=str)
+            return retorno
+        return grabar
+
+    def __setattr__(self, nombre: str, valor: Any) -> None:
+        setattr(self._cliente, nombre, valor)
+
+
+def clientes_grabadores(wsaa_cls, wsfev1_cls, path: str):
+    """Devuelve clases equivalentes a (WSAA, WSFEv1) que graban sus llamadas a AFIP en el cassette."""
+    return (lambda: _Grabador("wsaa", wsaa_cls(), path)), (lambda: _Grabador("wsfev1", wsfev1_cls(), path))
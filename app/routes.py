@@ -1,9 +1,15 @@
 import json
+import math
 from flask import request
 from flask_restx import Namespace, Resource, fields
+from werkzeug.exceptions import HTTPException
 from app.logger_setup import logger
 from app.factura_electronica import facturar, consultar_comprobante
+from app.conciliacion import conciliar
+from app.caea import facturar_caea, MODO_CAE, MODO_CAEA
 from app.otel_setup import get_tracer
+from app.limitador import LimiteExcedido
+from app import salud
 from typing import Dict
 
 # Crear namespace para Flask-RESTX
@@ -27,7 +33,9 @@ factura_model = afipws_ns.model('Factura', {
     'asociado_tipo_afip': fields.Integer(description='Tipo de comprobante asociado'),
     'asociado_punto_venta': fields.Integer(description='Punto de venta del comprobante asociado'),
     'asociado_numero_comprobante': fields.Integer(description='Número de comprobante asociado'),
-    'asociado_fecha_comprobante': fields.String(description='Fecha del comprobante asociado')
+    'asociado_fecha_comprobante': fields.String(description='Fecha del comprobante asociado'),
+    'modo': fields.String(description='Modo de autorización: CAE (en línea) o CAEA (anticipado, informado en segundo plano)',
+                          enum=[MODO_CAE, MODO_CAEA], default=MODO_CAE, example=MODO_CAE)
 })
 
 response_model = afipws_ns.model('Response', {
@@ -56,7 +64,8 @@ factura_response_model = afipws_ns.model('FacturaResponse', {
     'asociado_punto_venta': fields.Integer(description='Punto de venta del comprobante asociado'),
     'asociado_numero_comprobante': fields.Integer(description='Número de comprobante asociado'),
     'asociado_fecha_comprobante': fields.String(description='Fecha del comprobante asociado'),
-    'id_condicion_iva': fields.Integer(description='ID de condición IVA del receptor')
+    'id_condicion_iva': fields.Integer(description='ID de condición IVA del receptor'),
+    'modo': fields.String(description='Modo de autorización utilizado (CAE o CAEA)')
 })
 
 test_response_model = afipws_ns.model('TestResponse', {
@@ -73,6 +82,27 @@ consulta_response_model = afipws_ns.model('ConsultaResponse', {
     'factura': fields.Raw(description='Datos del comprobante consultado (si existe)', required=False)
 })
 
+conciliacion_model = afipws_ns.model('Conciliacion', {
+    'fecha_desde': fields.String(required=True, description='Fecha inicial (AAAAMMDD)', example='20240101'),
+    'fecha_hasta': fields.String(required=True, description='Fecha final (AAAAMMDD)', example='20240131'),
+    'puntos_venta': fields.List(fields.Integer, required=True, description='Puntos de venta a conciliar', example=[34]),
+    'tipos_cbte': fields.List(fields.Integer, description='Tipos de comprobante (por defecto los del diario local)', example=[6]),
+    'incremental': fields.Boolean(description='Revisar solo números posteriores a la última conciliación', default=False)
+})
+
+conciliacion_response_model = afipws_ns.model('ConciliacionResponse', {
+    'fecha_desde': fields.String(description='Fecha inicial conciliada'),
+    'fecha_hasta': fields.String(description='Fecha final conciliada'),
+    'comprobantes_revisados': fields.Integer(description='Cantidad de comprobantes de AFIP en el rango'),
+    'faltantes_local': fields.Raw(description='Comprobantes autorizados en AFIP que no están en el diario local'),
+    'faltantes_afip': fields.Raw(description='Comprobantes del diario local que AFIP no tiene autorizados'),
+    'diferencias_total': fields.Raw(description='Comprobantes con importe total distinto'),
+    'sin_cae': fields.Raw(description='Comprobantes locales sin CAE o con CAE distinto al de AFIP'),
+    'sin_datos_afip': fields.Raw(description='Números sin datos en AFIP (huecos en la numeración)'),
+    'ultimos_autorizados': fields.Raw(description='Último número autorizado por tipo-punto de venta'),
+    'error': fields.String(description='Mensaje de error si aplica')
+})
+
 
 @afipws_ns.route('/test')
 class TestResource(Resource):
@@ -132,10 +162,19 @@ class ConsultaComprobanteResource(Resource):
                     
                     return result
 
+                except LimiteExcedido as e:
+                    span.set_attribute("error", str(e))
+                    span.set_attribute("error.type", type(e).__name__)
+                    span.set_attribute("afip.limite.operacion", e.operacion)
+                    logger.warning(f'Consulta rechazada por límite de tasa: {str(e)}')
+                    return {"mensaje": str(e), "factura": None}, 429, _retry_after(e)
+                except HTTPException:
+                    raise
                 except Exception as e:
                     span.set_attribute("error", str(e))
                     span.set_attribute("error.type", type(e).__name__)
                     logger.error(f'Error al consultar comprobante: {str(e)}')
+                    salud.registrar_falla_afip(e)
                     return {"mensaje": f"Error interno del servidor: {str(e)}", "factura": None}, 500
         else:
             # No tracer
@@ -158,11 +197,34 @@ class ConsultaComprobanteResource(Resource):
 
                 return result
 
+            except LimiteExcedido as e:
+                logger.warning(f'Consulta rechazada por límite de tasa: {str(e)}')
+                return {"mensaje": str(e), "factura": None}, 429, _retry_after(e)
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f'Error al consultar comprobante: {str(e)}')
+                salud.registrar_falla_afip(e)
                 return {"mensaje": f"Error interno del servidor: {str(e)}", "factura": None}, 500
 
 
+def _retry_after(error: LimiteExcedido) -> Dict[str, str]:
+    """Header Retry-After (en segundos enteros) para una respuesta 429."""
+    return {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+
+
+def _facturar(json_data: Dict, production: bool, modo: str) -> Dict:
+    """Emite la factura con CAE (en línea) o con CAEA (anticipado) según el modo."""
+    if modo == MODO_CAEA:
+        result = facturar_caea(json_data, production=production)
+    elif modo == MODO_CAE:
+        result = facturar(json_data, production=production)
+    else:
+        raise ValueError(f"Modo de autorización inválido: {modo}")
+    result['modo'] = modo
+    return result
+
+
 @afipws_ns.route('/facturador')
 class FacturadorResource(Resource):
     @afipws_ns.doc('facturar')
@@ -180,9 +242,8 @@ class FacturadorResource(Resource):
                 try:
                     json_data = request.get_json()
                     
-                    if json_data is None:
-                        span.set_attribute("error", "No se proporcionó un JSON válido")
-                        afipws_ns.abort(400, "No se proporcionó un JSON válido")
+                    if not isinstance(json_data, dict):
+                        raise ValueError("No se proporcionó un JSON válido")
                     
                     # Agregar atributos del span con información de la factura
                     span.set_attribute("factura.tipo_afip", json_data.get('tipo_afip', 0))
@@ -197,9 +258,12 @@ class FacturadorResource(Resource):
                     # Obtener la configuración desde la variable global
                     production = _afip_config.get('production', False)
                     
+                    modo = str(json_data.get('modo') or MODO_CAE).upper()
+                    span.set_attribute("factura.modo", modo)
+                    
                     with tracer.start_as_current_span("facturar_afip") as factura_span:
                         factura_span.set_attribute("afip.production", production)
-                        result = facturar(json_data, production=production)
+                        result = _facturar(json_data, production, modo)
                     
                     logger.info(f"json_data (after)={result}")
                     
@@ -209,18 +273,30 @@ class FacturadorResource(Resource):
                     
                     return result
                     
+                except LimiteExcedido as e:
+                    span.set_attribute("error", str(e))
+                    span.set_attribute("error.type", type(e).__name__)
+                    span.set_attribute("afip.limite.operacion", e.operacion)
+                    logger.warning(f'Facturación rechazada por límite de tasa: {str(e)}')
+                    return {"success": False, "error": str(e)}, 429, _retry_after(e)
+                except ValueError as e:
+                    span.set_attribute("error", str(e))
+                    span.set_attribute("error.type", type(e).__name__)
+                    logger.warning(f'Factura inválida: {str(e)}')
+                    return {"success": False, "error": str(e)}, 400
                 except Exception as e:
                     span.set_attribute("error", str(e))
                     span.set_attribute("error.type", type(e).__name__)
                     logger.error(f'Error al facturar: {str(e)}')
+                    salud.registrar_falla_afip(e)
                     return {"success": False, "error": str(e)}, 500
         else:
             # Código original sin trazas
             try:
                 json_data = request.get_json()
                 
-                if json_data is None:
-                    afipws_ns.abort(400, "No se proporcionó un JSON válido")
+                if not isinstance(json_data, dict):
+                    raise ValueError("No se proporcionó un JSON válido")
                 
                 logger.info("facturando ...")
                 logger.info(f"json_data=\n{json.dumps(json_data, indent=2)}")
@@ -228,8 +304,9 @@ class FacturadorResource(Resource):
                 
                 # Obtener la configuración desde la variable global
                 production = _afip_config.get('production', False)
+                modo = str(json_data.get('modo') or MODO_CAE).upper()
                 
-                result = facturar(json_data, production=production)
+                result = _facturar(json_data, production, modo)
                 logger.info(f"json_data (after)={result}")
                 
                 # Logging detallado para debug
@@ -238,19 +315,130 @@ class FacturadorResource(Resource):
                 
                 return result
                 
+            except LimiteExcedido as e:
+                logger.warning(f'Facturación rechazada por límite de tasa: {str(e)}')
+                return {"success": False, "error": str(e)}, 429, _retry_after(e)
+            except ValueError as e:
+                logger.warning(f'Factura inválida: {str(e)}')
+                return {"success": False, "error": str(e)}, 400
             except Exception as e:
                 logger.error(f'Error al facturar: {str(e)}')
+                salud.registrar_falla_afip(e)
                 return {"success": False, "error": str(e)}, 500
 
 
-@afipws_ns.route('/health')
+@afipws_ns.route('/conciliacion')
+class ConciliacionResource(Resource):
+    @afipws_ns.doc('conciliar')
+    @afipws_ns.expect(conciliacion_model)
+    @afipws_ns.marshal_with(conciliacion_response_model)
+    def post(self):
+        """Endpoint para conciliar el diario local contra los comprobantes autorizados en AFIP."""
+        tracer = get_tracer()
+
+        if tracer:
+            with tracer.start_as_current_span("conciliacion_endpoint") as span:
+                span.set_attribute("endpoint", "/conciliacion")
+                span.set_attribute("method", "POST")
+
+                try:
+                    json_data = request.get_json()
+
+                    if not isinstance(json_data, dict):
+                        raise ValueError("No se proporcionó un JSON válido")
+
+                    span.set_attribute("conciliacion.fecha_desde", json_data.get('fecha_desde', ''))
+                    span.set_attribute("conciliacion.fecha_hasta", json_data.get('fecha_hasta', ''))
+                    span.set_attribute("conciliacion.incremental", bool(json_data.get('incremental', False)))
+
+                    logger.info(f"Conciliando: {json_data}")
+
+                    production = _afip_config.get('production', False)
+
+                    with tracer.start_as_current_span("conciliar_afip") as conciliacion_span:
+                        conciliacion_span.set_attribute("afip.production", production)
+                        result = conciliar(
+                            json_data.get('fecha_desde'),
+                            json_data.get('fecha_hasta'),
+                            json_data.get('puntos_venta'),
+                            tipos_cbte=json_data.get('tipos_cbte'),
+                            incremental=bool(json_data.get('incremental', False)),
+                            production=production,
+                        )
+                    span.set_attribute("conciliacion.revisados", result['comprobantes_revisados'])
+
+                    return result
+
+                except LimiteExcedido as e:
+                    span.set_attribute("error", str(e))
+                    span.set_attribute("error.type", type(e).__name__)
+                    span.set_attribute("afip.limite.operacion", e.operacion)
+                    logger.warning(f'Conciliación rechazada por límite de tasa: {str(e)}')
+                    return {"error": str(e)}, 429, _retry_after(e)
+                except ValueError as e:
+                    span.set_attribute("error", str(e))
+                    span.set_attribute("error.type", type(e).__name__)
+                    logger.warning(f'Solicitud de conciliación inválida: {str(e)}')
+                    return {"error": str(e)}, 400
+                except Exception as e:
+                    span.set_attribute("error", str(e))
+                    span.set_attribute("error.type", type(e).__name__)
+                    logger.error(f'Error al conciliar: {str(e)}')
+                    salud.registrar_falla_afip(e)
+                    return {"error": str(e)}, 500
+        else:
+            try:
+                json_data = request.get_json()
+
+                if not isinstance(json_data, dict):
+                    raise ValueError("No se proporcionó un JSON válido")
+
+                logger.info(f"Conciliando: {json_data}")
+
+                production = _afip_config.get('production', False)
+
+                result = conciliar(
+                    json_data.get('fecha_desde'),
+                    json_data.get('fecha_hasta'),
+                    json_data.get('puntos_venta'),
+                    tipos_cbte=json_data.get('tipos_cbte'),
+                    incremental=bool(json_data.get('incremental', False)),
+                    production=production,
+                )
+
+                return result
+
+            except LimiteExcedido as e:
+                logger.warning(f'Conciliación rechazada por límite de tasa: {str(e)}')
+                return {"error": str(e)}, 429, _retry_after(e)
+            except ValueError as e:
+                logger.warning(f'Solicitud de conciliación inválida: {str(e)}')
+                return {"error": str(e)}, 400
+            except Exception as e:
+                logger.error(f'Error al conciliar: {str(e)}')
+                salud.registrar_falla_afip(e)
+                return {"error": str(e)}, 500
+
+
+@afipws_ns.route('/health', '/health/live')
 class HealthResource(Resource):
     @afipws_ns.doc('health_check')
     def get(self):
-        """Endpoint de chequeo de salud para Consul."""
+        """Liveness: el proceso responde. No verifica AFIP."""
         return {"status": "ok"}
 
 
+@afipws_ns.route('/health/ready')
+class ReadinessResource(Resource):
+    @afipws_ns.doc('readiness_check', responses={200: 'Listo para recibir tráfico', 503: 'Degradado'})
+    def get(self):
+        """Readiness para Consul: estado de AFIP, ticket, saturación y corte por fallas (en cache, sin llamadas SOAP)."""
+        if salud.monitor is None:
+            return {"status": "iniciando"}, 503
+        listo, detalle = salud.monitor.readiness()
+        return detalle, 200 if listo else 503
+
+
 def register_routes(config: Dict, api):
     """Configura y registra las rutas con la API de Flask-RESTX."""
     # Guardar la configuración en la variable global
@@ -0,0 +1,238 @@
+"""
+Chequeos de salud del servicio (liveness y readiness).
+
+Un hilo en segundo plano sondea periódicamente AFIP (FEDummy) y guarda el
+resultado; el endpoint de readiness solo lee ese resultado en cache, por lo
+que los chequeos de Consul no generan llamadas SOAP.
+"""
+import os
+import time
+import datetime
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from flask import Flask, request, g
+
+from app.logger_setup import logger
+from app.factura_electronica import conectar_wsfev1, estado_servidores, estado_ticket
+from app.limitador import metricas as metricas_limites
+from app.caea import estado_pendientes
+
+SALUD_INTERVALO = int(os.getenv("SALUD_INTERVALO", 30))
+# Fallas consecutivas de AFIP a partir de las cuales se deja de recibir tráfico
+SALUD_UMBRAL_FALLAS = int(os.getenv("SALUD_UMBRAL_FALLAS", 5))
+MAX_SOLICITUDES_CONCURRENTES = int(os.getenv("MAX_SOLICITUDES_CONCURRENTES", 32))
+# Prefijo de las rutas que operan contra AFIP (las de salud no cuentan)
+PREFIJO_AFIP = "/api/afipws/"
+
+
+class MonitorSalud:
+    """
+    Mantiene en cache el estado de AFIP, del ticket de acceso, de la saturación
+    de solicitudes y del corte por fallas consecutivas.
+
+    Args:
+        production: Si es True usa ambiente de producción, sino homologación
+        intervalo: Segundos entre sondeos a AFIP
+    """
+
+    def __init__(self, production: bool = False, intervalo: int = SALUD_INTERVALO) -> None:
+        self.production = production
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._wsfev1 = None
+        self._servidores: Dict[str, Any] = {"estado": "iniciando"}
+        self._en_curso = 0
+        self._fallas_consecutivas = 0
+        self._corte_desde: Optional[float] = None
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+
+    # -- sondeo en segundo plano -------------------------------------------
+
+    def sondear(self) -> None:
+        """Consulta FEDummy y actualiza el estado en cache."""
+        inicio = time.monotonic()
+        try:
+            if self._wsfev1 is None:
+                self._wsfev1 = conectar_wsfev1(None, self.production)
+            servidores = estado_servidores(self._wsfev1)
+            ok = all(valor == "OK" for valor in servidores.values())
+            resultado = {"estado": "ok" if ok else "degradado", **servidores}
+        except Exception as e:
+            logger.warning(f"Sondeo de AFIP fallido: {e}")
+            # forzar reconexión en el próximo sondeo
+            self._wsfev1 = None
+            ok = False
+            resultado = {"estado": "error", "error": str(e)}
+        resultado["duracion_ms"] = round((time.monotonic() - inicio) * 1000)
+        resultado["actualizado"] = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._servidores = resultado
+            # con AFIP respondiendo se vuelve a aceptar tráfico tras el corte
+            if ok and self._corte_desde is not None:
+                logger.info("AFIP disponible nuevamente, se cierra el corte por fallas")
+                self._corte_desde = None
+                self._fallas_consecutivas = 0
+
+    def _ciclo(self) -> None:
+        self.sondear()
+        while not self._detener.wait(self.intervalo):
+            self.sondear()
+
+    def iniciar(self) -> None:
+        """Inicia el hilo de sondeo en segundo plano."""
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._ciclo, name="monitor-salud", daemon=True)
+            self._hilo.start()
+
+    def detener(self) -> None:
+        self._detener.set()
+
+    # -- seguimiento de solicitudes ----------------------------------------
+
+    def inicio_solicitud(self) -> None:
+        with self._lock:
+            self._en_curso += 1
+
+    def fin_solicitud(self) -> None:
+        with self._lock:
+            self._en_curso -= 1
+
+    def registrar_resultado(self, status_code: int, falla_afip: bool = False) -> None:
+        """
+        Registra el resultado de una solicitud.
+
+        Solo las fallas de AFIP o de la comunicación con AFIP cuentan para el
+        corte; los errores de los datos enviados por el cliente no.
+        """
+        with self._lock:
+            if falla_afip:
+                self._fallas_consecutivas += 1
+                if self._fallas_consecutivas >= SALUD_UMBRAL_FALLAS and self._corte_desde is None:
+                    logger.error(f"{self._fallas_consecutivas} fallas consecutivas de AFIP, se abre el corte")
+                    self._corte_desde = time.time()
+            elif status_code < 400:
+                self._fallas_consecutivas = 0
+
+    # -- estado ------------------------------------------------------------
+
+    def _ticket(self) -> Dict[str, Any]:
+        ticket = estado_ticket()
+        vencimiento = ticket["vencimiento"]
+        vigente = None
+        if vencimiento:
+            try:
+                vigente = datetime.datetime.fromisoformat(vencimiento) > datetime.datetime.now(datetime.timezone.utc)
+            except (ValueError, TypeError):
+                pass
+        # sin ticket aún (o vencido) no es una falla: se obtiene en la próxima operación
+        ticket["estado"] = "error" if ticket["error"] and not vigente else "ok"
+        ticket["vigente"] = vigente
+        return ticket
+
+    def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Devuelve si la instancia puede recibir tráfico y el detalle de cada chequeo.
+
+        No realiza llamadas a AFIP: usa el último resultado del sondeo.
+        """
+        with self._lock:
+            servidores = dict(self._servidores)
+            en_curso = self._en_curso
+            fallas = self._fallas_consecutivas
+            corte_desde = self._corte_desde
+        ticket = self._ticket()
+        saturado = en_curso >= MAX_SOLICITUDES_CONCURRENTES
+        chequeos = {
+            "afip": servidores,
+            "ticket": ticket,
+            "solicitudes": {
+                "estado": "saturado" if saturado else "ok",
+                "en_curso": en_curso,
+                "maximo": MAX_SOLICITUDES_CONCURRENTES,
+            },
+            "corte": {
+                "estado": "abierto" if corte_desde is not None else "cerrado",
+                "fallas_consecutivas": fallas,
+            },
+        }
+        # informativo: pendientes CAEA cerca de la fecha tope no se resuelven sacando la instancia de servicio
+        caea = estado_pendientes(self.production)
+        if caea is not None:
+            chequeos["caea"] = caea
+        listo = (
+            servidores["estado"] == "ok"
+            and ticket["estado"] == "ok"
+            and not saturado
+            and corte_desde is None
+        )
+        return listo, {
+            "status": "ok" if listo else "degradado",
+            "chequeos": chequeos,
+            "limites": metricas_limites(),
+        }
+
+
+monitor: Optional[MonitorSalud] = None
+
+
+def es_falla_afip(error: BaseException) -> bool:
+    """
+    Indica si un error es de AFIP o de la comunicación con AFIP, y no de los datos de la solicitud.
+
+    Cuentan los errores informados por AFIP (``RuntimeError`` con su ErrMsg,
+    ``SoapFault``) y los de red (``OSError``, incluidos los timeouts, y los de
+    httplib2, el transporte de pysimplesoap).
+    """
+    return isinstance(error, (RuntimeError, OSError)) or type(error).__module__.startswith("httplib2")
+
+
+def registrar_falla_afip(error: BaseException) -> None:
+    """Marca la solicitud en curso como fallida por AFIP, para el corte por fallas consecutivas, si ``error`` lo es."""
+    if es_falla_afip(error):
+        g.falla_afip = True
+
+
+def registrar_monitor(app: Flask, config: Dict[str, Any]) -> MonitorSalud:
+    """
+    Crea el monitor de salud, lo engancha a las solicitudes de la aplicación e inicia el sondeo.
+
+    Args:
+        app: La aplicación Flask
+        config: Configuración del servicio
+
+    Returns:
+        El monitor de salud iniciado
+    """
+    global monitor
+    monitor = MonitorSalud(production=config.get('production', False))
+
+    def _es_afip() -> bool:
+        return request.path.startswith(PREFIJO_AFIP) and "/health" not in request.path
+
+    @app.before_request
+    def _inicio_solicitud():
+        if _es_afip():
+            monitor.inicio_solicitud()
+            g.en_curso = True
+
+    @app.after_request
+    def _resultado_solicitud(response):
+        if g.get("en_curso", False):
+            monitor.registrar_resultado(response.status_code, g.get("falla_afip", False))
+            g.resultado_registrado = True
+        return response
+
+    @app.teardown_request
+    def _fin_solicitud(error):
+        # after_request no se ejecuta si la excepción se propaga: el contador se libera acá
+        if g.get("en_curso", False):
+            if error is not None and not g.get("resultado_registrado", False):
+                monitor.registrar_resultado(500, es_falla_afip(error))
+            monitor.fin_solicitud()
+            g.en_curso = False
+
+    monitor.iniciar()
+    return monitor
@@ -1,27 +1,29 @@
 from typing import Dict, Any
 import os
-from pathlib import Path
+import threading
+import time
 
-import consul
-from dotenv import load_dotenv
 from flask import Flask
 from flask_restx import Api
 
 from app.logger_setup import logger
 from app.routes import register_routes
 from app.otel_setup import setup_otel, instrument_app
+from app.salud import registrar_monitor
+from app.codificacion import registrar_codificaciones
 
 # Constantes
 CONSUL_DEFAULT_PORT = 8500
 CONSUL_DEFAULT_HOST = 'consul-service'
 INSTANCE_DEFAULT_PORT = 5000
 DEFAULT_CERT_DATE = '2019-01-01'
+CONSUL_REGISTER_RETRIES = 5
+CONSUL_REGISTER_BACKOFF = 2
+SERVICE_NAME = 'pyafipws-service'
 
 
 def load_config() -> Dict[str, Any]:
-    """Carga y valida la configuración desde variables de entorno."""
-    load_dotenv()
-
+    """Carga y valida la configuración desde variables de entorno (el .env se carga al importar `app`)."""
     config = {
         'production': os.getenv('PRODUCTION', 'FALSE').upper() == 'TRUE',
         'consul_port': int(os.getenv('CONSUL_PORT', CONSUL_DEFAULT_PORT)),
@@ -39,15 +41,43 @@ def load_config() -> Dict[str, Any]:
     return config
 
 
-def read_file_content(file_path: str, file_type: str) -> str:
-    """Lee el contenido de un archivo de forma segura."""
-    try:
-        content = Path(file_path).read_text()
-        logger.info(f'Contenido del archivo {file_type}:\n{content}')
-        return content
-    except Exception as e:
-        logger.error(f'Error al leer el archivo {file_type}: {e}')
-        raise RuntimeError(f'Error al leer el archivo {file_type}') from e
+def check_file_readable(file_path: str, file_type: str) -> None:
+    """Verifica que un archivo exista y sea legible, sin leer ni registrar su contenido."""
+    if not file_path or not os.path.isfile(file_path) or not os.access(file_path, os.R_OK):
+        logger.error(f'El archivo {file_type} no existe o no es legible: {file_path}')
+        raise RuntimeError(f'Error al leer el archivo {file_type}')
+    logger.info(f'Archivo {file_type} disponible: {file_path}')
+
+
+def register_consul(config: Dict[str, Any]) -> bool:
+    """
+    Registra el servicio en Consul, reintentando con espera exponencial.
+
+    Returns:
+        True si el registro fue exitoso
+    """
+    import consul
+
+    service_port = config['instance_port']
+    consul_client = consul.Consul(host=config['consul_host'], port=config['consul_port'])
+    for attempt in range(1, CONSUL_REGISTER_RETRIES + 1):
+        try:
+            consul_client.agent.service.register(
+                name=SERVICE_NAME,
+                service_id=f'{SERVICE_NAME}-{service_port}',
+                address=SERVICE_NAME,
+                port=service_port,
+                tags=['pyafipws', 'facturacion-electronica', 'afip'],
+                check=consul.Check.http(f'http://{SERVICE_NAME}:{service_port}/api/afipws/health/ready', interval='10s')
+            )
+            logger.info(f'Servicio registrado en Consul ({config["consul_host"]}:{config["consul_port"]})')
+            return True
+        except Exception as e:
+            logger.warning(f'Error al registrar en Consul (intento {attempt}/{CONSUL_REGISTER_RETRIES}): {e}')
+            if attempt < CONSUL_REGISTER_RETRIES:
+                time.sleep(CONSUL_REGISTER_BACKOFF ** attempt)
+    logger.error('No se pudo registrar el servicio en Consul')
+    return False
 
 
 def create_app(config: Dict[str, Any] = None) -> Flask:
@@ -56,27 +86,27 @@ def create_app(config: Dict[str, Any] = None) -> Flask:
     if config is None:
         config = load_config()
 
-    # Leer archivos de certificados
-    read_file_content(config['cert_path'], 'CERT')
-    read_file_content(config['privatekey_path'], 'PRIVATEKEY')
+    # Verificar archivos de certificados (se leen recién al autenticar con WSAA)
+    check_file_readable(config['cert_path'], 'CERT')
+    check_file_readable(config['privatekey_path'], 'PRIVATEKEY')
+
+    # Los cassettes de AFIP (app/replay.py) son solo para pruebas en homologación
+    if config['production'] and (os.getenv('AFIP_REPLAY') or os.getenv('AFIP_GRABAR')):
+        logger.error('AFIP_REPLAY/AFIP_GRABAR definidos con PRODUCTION=TRUE')
+        raise RuntimeError('AFIP_REPLAY y AFIP_GRABAR no se admiten en producción')
 
-    # Configurar OpenTelemetry (opcional, solo si está configurado)
+    # Configurar OpenTelemetry (opcional, solo si está configurado). La instrumentación
+    # debe quedar aplicada antes de atender la primera solicitud.
     tracer = setup_otel()
     if tracer:
         instrument_app(app)
 
-    # Configurar Consul
-    consul_client = consul.Consul(host=config['consul_host'], port=config['consul_port'])
-    service_name = 'pyafipws-service'
-    service_port = config['instance_port']
-    consul_client.agent.service.register(
-        name=service_name,
-        service_id=f'{service_name}-{service_port}',
-        address=service_name,
-        port=service_port,
-        tags=['pyafipws', 'facturacion-electronica', 'afip'],
-        check=consul.Check.http(f'http://{service_name}:{service_port}/api/afipws/health', interval='10s')
-    )
+    # Registrar en Consul en segundo plano: la instancia atiende solicitudes mientras
+    # tanto y Consul le envía tráfico recién cuando el chequeo de readiness da ok
+    if config.get('consul_host'):
+        threading.Thread(target=register_consul, args=(config,), name='registro-consul', daemon=True).start()
+    else:
+        logger.info('CONSUL_HOST vacío: no se registra el servicio en Consul')
 
     # Configurar Flask-RESTX con Swagger
     api = Api(
@@ -91,12 +121,33 @@ def create_app(config: Dict[str, Any] = None) -> Flask:
     # Registrar rutas con la API
     register_routes(config, api)
 
+    # Formatos compactos (MessagePack/CBOR) y compresión gzip/zstd de las respuestas
+    registrar_codificaciones(app, api)
+
+    # Sondeo de AFIP en segundo plano para el chequeo de readiness
+    registrar_monitor(app, config)
+
     return app
 
 
-# Creación de la aplicación
-config = load_config()
-app = create_app(config)
+_app = None
+_app_lock = threading.Lock()
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Crea la aplicación en el primer acceso a `app.service.app` (p. ej. desde
+    `flask run` o el servidor WSGI) en lugar de hacerlo al importar el módulo.
+    """
+    global _app
+    if name == 'app':
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+        return _app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=config['instance_port'])
+    config = load_config()
+    create_app(config).run(debug=True, host='0.0.0.0', port=config['instance_port'])
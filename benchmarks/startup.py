@@ -0,0 +1,98 @@
+"""
+Benchmark de arranque del servicio.
+
+Mide, en procesos nuevos de Python:
+
+- el tiempo de importación de `app.service` (con `python -X importtime`),
+  listando los módulos más costosos;
+- el tiempo hasta la primera respuesta: desde que se lanza el intérprete
+  hasta que `create_app()` atiende `GET /api/afipws/health/live`.
+
+Uso:
+    python benchmarks/startup.py [--runs N] [--top N] [--max-ms MS]
+
+Con `--max-ms` termina con código 1 si la mediana del tiempo hasta la
+primera respuesta supera el umbral (para usar en CI).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = (
+    "from app.service import create_app\n"
+    "client = create_app().test_client()\n"
+    "assert client.get('/api/afipws/health/live').status_code == 200\n"
+)
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    # certificados ficticios: el arranque solo verifica que existan
+    if not env.get('CERT') or not os.path.isfile(env['CERT']):
+        dummy = os.path.join(tempfile.gettempdir(), 'startup_benchmark.crt')
+        open(dummy, 'a').close()
+        env['CERT'] = env['PRIVATEKEY'] = dummy
+    # sin registro en Consul: solo se mide el arranque del servicio
+    env['CONSUL_HOST'] = ''
+    env['INSTANCE_PORT'] = env.get('INSTANCE_PORT') or '5000'
+    return env
+
+
+def import_times(top: int) -> Tuple[float, List[Tuple[int, str]]]:
+    """Devuelve el tiempo total de importación (ms) y los `top` módulos más costosos."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app.service'],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        modules.append((int(cumulative_us), int(self_us), name))
+    total = next((cum for cum, _, name in modules if name == 'app.service'), 0) / 1000
+    by_self = sorted(((self_us, name.strip()) for _, self_us, name in modules), reverse=True)
+    return total, by_self[:top]
+
+
+def time_to_first_request() -> float:
+    """Tiempo (ms) desde que se lanza el intérprete hasta la primera respuesta."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', FIRST_REQUEST], cwd=ROOT, env=_env(),
+                   capture_output=True, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Cantidad de arranques a medir')
+    parser.add_argument('--top', type=int, default=15, help='Módulos más costosos a listar')
+    parser.add_argument('--max-ms', type=float, help='Umbral para la mediana del tiempo hasta la primera respuesta')
+    args = parser.parse_args()
+
+    total, top = import_times(args.top)
+    print(f'Importación de app.service: {total:.1f} ms')
+    for self_us, name in top:
+        print(f'  {self_us / 1000:8.1f} ms  {name}')
+
+    samples = [time_to_first_request() for _ in range(args.runs)]
+    median = statistics.median(samples)
+    print(f'Tiempo hasta la primera respuesta: mediana {median:.1f} ms '
+          f'(min {min(samples):.1f} ms, max {max(samples):.1f} ms, {args.runs} corridas)')
+
+    if args.max_ms is not None and median > args.max_ms:
+        print(f'ERROR: la mediana supera el umbral de {args.max_ms:.1f} ms')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
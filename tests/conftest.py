@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+import pytest
+
+CASSETTES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cassettes')
+TMP = tempfile.mkdtemp(prefix='pyafipws-tests-')
+
+# La configuración se lee al importar los módulos de `app`: debe definirse antes
+# (y tiene prioridad sobre el .env). Las llamadas a AFIP se responden desde el cassette.
+os.environ.update({
+    'AFIP_REPLAY': os.path.join(CASSETTES, 'wsfev1_homologacion.json'),
+    'CUIT': '20267565393',
+    'CERT': 'user.crt',
+    'PRIVATEKEY': 'user.key',
+    'PRODUCTION': 'FALSE',
+    'INSTANCE_PORT': '5000',
+    'CONSUL_HOST': '',
+    'LIMITE_DIRECTORIO': os.path.join(TMP, 'limites'),
+    'LIMITE_TASA': '100000',
+    'LIMITE_CAPACIDAD': '100000',
+    'CAEA_CACHE': os.path.join(TMP, 'caea_cache.json'),
+    'CAEA_PENDIENTES': os.path.join(TMP, 'caea_pendientes.jsonl'),
+    'CONCILIACION_ESTADO': os.path.join(TMP, 'conciliacion_estado.json'),
+    'CONCILIACION_WORKERS': '1',
+    'DIARIO_COMPROBANTES': '',
+})
+os.chdir(TMP)
+for certificado in ('user.crt', 'user.key'):
+    open(certificado, 'a').close()
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app.service import create_app
+
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def factura():
+    return {
+        'tipo_documento': 96,
+        'documento': '22222222',
+        'tipo_afip': 6,
+        'punto_venta': 4000,
+        'total': 121.0,
+        'neto': 100.0,
+        'iva': 21.0,
+        'neto105': 0.0,
+        'iva105': 0.0,
+        'id_condicion_iva': 5,
+    }
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    """Cache vacía en cada prueba: tickets, numeración y consultas no pasan de una a otra."""
+    from app import cache as modulo
+
+    nueva = modulo.MemoriaCache()
+    monkeypatch.setattr(modulo, '_cache', nueva)
+    return nueva
@@ -0,0 +1,107 @@
+"""
+Costo por solicitud de las rutas principales, de punta a punta a través de Flask.
+
+Las llamadas a AFIP se responden desde el cassette sin latencia, de modo que se
+mide solo el costo propio del servicio. `test_costo_*` compara contra
+`tests/benchmarks/umbrales.json` (con un margen de `BENCHMARK_TOLERANCIA`) y falla
+si se superan:
+
+- el tiempo de CPU, relativo al de una solicitud de referencia (`/health/live`)
+  medida en la misma ejecución, para no depender de la velocidad de la máquina;
+- el pico de memoria asignada, en KiB.
+
+`test_benchmark_*` registran las mediciones de pytest-benchmark
+(`--benchmark-json` para guardarlas).
+"""
+import os
+import json
+import time
+import statistics
+import tracemalloc
+
+import pytest
+
+from app import factura_electronica
+
+UMBRALES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'umbrales.json')
+TOLERANCIA = float(os.getenv('BENCHMARK_TOLERANCIA', 1.5))
+REPETICIONES = 50
+
+CONSULTA = '/api/afipws/consulta_comprobante?tipo_cbte=6&punto_vta=4000&cbte_nro=100'
+REFERENCIA = '/api/afipws/health/live'
+
+
+@pytest.fixture(autouse=True)
+def sin_cache_de_consultas(monkeypatch):
+    # cada consulta medida llega a AFIP (el cassette) en lugar de leerse de la cache
+    monkeypatch.setattr(factura_electronica, 'CONSULTA_TTL', 0)
+
+
+@pytest.fixture(scope='module')
+def umbrales():
+    with open(UMBRALES, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _facturar(client, factura):
+    response = client.post('/api/afipws/facturador', json=factura)
+    assert response.status_code == 200
+    return response
+
+
+def _consultar(client, factura=None):
+    response = client.get(CONSULTA)
+    assert response.status_code == 200
+    return response
+
+
+def _referencia(client, factura=None):
+    response = client.get(REFERENCIA)
+    assert response.status_code == 200
+    return response
+
+
+@pytest.fixture(scope='module')
+def cpu_referencia(app):
+    """Tiempo de CPU (ms) de la solicitud de referencia en esta máquina y ejecución."""
+    return _medir(_referencia, app.test_client(), None)[0]
+
+
+def _medir(solicitud, client, factura):
+    """Devuelve la mediana del tiempo de CPU (ms) y el pico de memoria asignada (KiB) por solicitud."""
+    for _ in range(5):
+        solicitud(client, factura)  # calentamiento: imports perezosos, caches de Flask
+    tiempos = []
+    for _ in range(REPETICIONES):
+        inicio = time.process_time()
+        solicitud(client, factura)
+        tiempos.append((time.process_time() - inicio) * 1000)
+
+    tracemalloc.start()
+    try:
+        solicitud(client, factura)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(tiempos), pico / 1024
+
+
+@pytest.mark.parametrize('ruta, solicitud', [('facturador', _facturar), ('consulta_comprobante', _consultar)])
+def test_costo_por_solicitud(client, factura, umbrales, cpu_referencia, ruta, solicitud):
+    cpu_ms, memoria_kib = _medir(solicitud, client, factura)
+    cpu_relativo = cpu_ms / cpu_referencia
+    umbral = umbrales[ruta]
+
+    assert cpu_relativo <= umbral['cpu_relativo'] * TOLERANCIA, \
+        f'{ruta}: {cpu_ms:.2f} ms de CPU por solicitud, {cpu_relativo:.1f} veces {REFERENCIA} ' \
+        f'(umbral {umbral["cpu_relativo"]} x {TOLERANCIA})'
+    assert memoria_kib <= umbral['memoria_kib'] * TOLERANCIA, \
+        f'{ruta}: {memoria_kib:.1f} KiB asignados por solicitud (umbral {umbral["memoria_kib"]} KiB x {TOLERANCIA})'
+
+
+def test_benchmark_facturador(benchmark, client, factura):
+    benchmark(_facturar, client, factura)
+
+
+def test_benchmark_consulta_comprobante(benchmark, client):
+    benchmark(_consultar, client)
@@ -0,0 +1,166 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import caea, factura_electronica
+from app import cache as cache_modulo
+from app.cache import MemoriaCache, SQLiteCache
+from app.factura_electronica import autenticar, siguiente_numero, consultar_comprobante, crear_comprobante
+
+
+@pytest.fixture(params=['memoria', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteCache(str(tmp_path / 'cache.db'))
+    return MemoriaCache()
+
+
+def test_get_set_delete(backend):
+    assert backend.get('clave') is None
+    backend.set('clave', {'valor': [1, 2]})
+    assert backend.get('clave') == {'valor': [1, 2]}
+    backend.delete('clave')
+    assert backend.get('clave') is None
+
+
+def test_vencimiento(backend):
+    backend.set('clave', 1, ttl=0.05)
+    assert backend.get('clave') == 1
+    time.sleep(0.06)
+    assert backend.get('clave') is None
+    assert backend.compare_and_set('clave', None, 2)
+
+
+def test_compare_and_set(backend):
+    assert backend.compare_and_set('clave', None, 1)
+    assert not backend.compare_and_set('clave', None, 1)
+    assert not backend.compare_and_set('clave', 5, 6)
+    assert backend.compare_and_set('clave', 1, 2)
+    assert backend.get('clave') == 2
+    assert backend.compare_and_set('clave', 2, None)
+    assert backend.get('clave') is None
+
+
+def test_bloqueo_exclusivo(backend):
+    with backend.bloqueo('bloqueo', ttl=5):
+        with pytest.raises(TimeoutError):
+            with backend.bloqueo('bloqueo', ttl=5, espera=0.1):
+                pass
+    with backend.bloqueo('bloqueo', ttl=5, espera=0.1):
+        pass
+
+
+def test_bloqueo_vencido(backend):
+    with backend.bloqueo('bloqueo', ttl=0.05):
+        # quien lo tomó no lo liberó a tiempo (p. ej. el proceso terminó)
+        with backend.bloqueo('bloqueo', ttl=5, espera=1):
+            pass
+
+
+def test_siguiente_numero_saltea_pendientes_caea(tmp_path, monkeypatch):
+    pendientes = tmp_path / 'pendientes.jsonl'
+    (tmp_path / 'pendientes.jsonl.numeros.json').write_text(json.dumps({'6-4000': 105}))
+    monkeypatch.setattr(caea, 'CAEA_PENDIENTES', str(pendientes))
+
+    assert siguiente_numero(6, 4000, lambda: '100') == 106
+    assert siguiente_numero(6, 4000, lambda: '110') == 111
+    assert siguiente_numero(6, 4001, lambda: None) == 1
+
+
+class _AFIPEnOrden:
+    """WSFEv1 simulado que, como AFIP, solo autoriza el número siguiente al último autorizado."""
+
+    def __init__(self, autorizados, lock):
+        self.autorizados = autorizados
+        self.lock = lock
+        self.ErrMsg = ''
+        self.Observaciones = []
+
+    def CompUltimoAutorizado(self, tipo_cbte, punto_vta):
+        with self.lock:
+            return self.autorizados[-1]
+
+    def CrearFactura(self, **encabezado):
+        self.cbte_nro = encabezado['cbte_nro']
+
+    def AgregarIva(self, **iva):
+        pass
+
+    def CAESolicitar(self):
+        time.sleep(0.002)
+        with self.lock:
+            if self.cbte_nro != self.autorizados[-1] + 1:
+                self.ErrMsg = '10016: El número de comprobante no es el siguiente al último autorizado'
+                return
+            self.autorizados.append(self.cbte_nro)
+        self.Resultado, self.CAE, self.Vencimiento = 'A', '74049145150923', '20240205'
+
+
+def test_autorizar_en_orden_por_punto_de_venta(cache, factura):
+    autorizados, lock = [100], threading.Lock()
+
+    def autorizar(_):
+        cbte = crear_comprobante(dict(factura))
+        cbte.autorizar(_AFIPEnOrden(autorizados, lock))
+        return cbte.encabezado['cbte_nro']
+
+    with ThreadPoolExecutor(8) as executor:
+        numeros = list(executor.map(autorizar, range(20)))
+
+    assert sorted(numeros) == list(range(101, 121))
+    assert autorizados == list(range(100, 121))
+
+
+def test_numeracion_sin_cache_compartida(factura, monkeypatch):
+    autorizados, lock = [100], threading.Lock()
+    numeros = []
+    # dos workers con el backend memoria, y un comprobante autorizado por fuera del servicio
+    for _ in range(2):
+        monkeypatch.setattr(cache_modulo, '_cache', MemoriaCache())
+        cbte = crear_comprobante(dict(factura))
+        cbte.autorizar(_AFIPEnOrden(autorizados, lock))
+        numeros.append(cbte.encabezado['cbte_nro'])
+        autorizados.append(autorizados[-1] + 1)
+
+    assert numeros == [101, 103]
+    assert autorizados == [100, 101, 102, 103, 104]
+
+
+def test_ticket_se_renueva_una_sola_vez(cache, monkeypatch):
+    solicitudes = []
+
+    def solicitar_ticket(production):
+        solicitudes.append(production)
+        time.sleep(0.1)
+        return {'ta': '<ta/>', 'vencimiento': '2099-01-26T22:00:00.000-03:00'}
+
+    monkeypatch.setattr(factura_electronica, '_solicitar_ticket', solicitar_ticket)
+    with ThreadPoolExecutor(8) as executor:
+        tickets = list(executor.map(lambda _: autenticar(), range(8)))
+
+    assert tickets == ['<ta/>'] * 8
+    assert len(solicitudes) == 1
+
+
+def test_ticket_por_vencer_no_se_guarda(cache, monkeypatch):
+    monkeypatch.setattr(factura_electronica, '_solicitar_ticket',
+                        lambda production: {'ta': '<ta/>', 'vencimiento': '2000-01-01T00:00:00.000-03:00'})
+
+    assert autenticar() == '<ta/>'
+    assert cache.get(f'ta:{factura_electronica.CUIT}:homologacion') is None
+
+
+def test_consulta_se_reutiliza(cache, monkeypatch):
+    primera = consultar_comprobante(6, 4000, 100)
+    monkeypatch.setattr(factura_electronica, 'autenticar', lambda production=False: pytest.fail('sin cache'))
+
+    assert consultar_comprobante(6, 4000, 100) == primera
+
+
+def test_consulta_no_encontrada_no_se_guarda(cache):
+    consultar_comprobante(6, 4000, 999)
+
+    assert cache.get(f'consulta:{factura_electronica.CUIT}:homologacion:6:4000:999') is None
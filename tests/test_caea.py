@@ -0,0 +1,137 @@
+import json
+import fcntl
+import datetime
+
+import pytest
+
+from app import caea
+from app import cache as cache_modulo
+from app.cache import MemoriaCache
+from app.caea import GestorCAEA, periodo_orden
+from app.factura_electronica import crear_comprobante
+
+CAEA = '24043829471234'
+
+
+@pytest.fixture
+def archivos(tmp_path):
+    """Cache con el CAEA de la quincena actual (no se pide a AFIP) y buffer de pendientes vacío."""
+    periodo, orden = periodo_orden(datetime.date.today())
+    cache = tmp_path / 'caea_cache.json'
+    cache.write_text(json.dumps({f'{periodo}-{orden}': {
+        'caea': CAEA, 'periodo': periodo, 'orden': orden,
+        'fch_vig_desde': '20240116', 'fch_vig_hasta': '20240131', 'fch_tope_inf': '20240208',
+    }}))
+    return str(cache), str(tmp_path / 'pendientes.jsonl')
+
+
+def _gestor(archivos):
+    cache, pendientes = archivos
+    return GestorCAEA(cache=cache, pendientes=pendientes)
+
+
+def test_emitir_sin_llamar_a_caesolicitar(archivos, factura):
+    gestor = _gestor(archivos)
+
+    encabezado = gestor.emitir(crear_comprobante(factura))
+
+    assert encabezado['cbte_nro'] == 101
+    assert encabezado['cae'] == CAEA
+    assert encabezado['resultado'] == 'A'
+    assert gestor.pendientes() == 1
+
+
+def test_informar_pendientes(archivos, factura):
+    gestor = _gestor(archivos)
+    gestor.emitir(crear_comprobante(factura))
+
+    assert gestor.informar_pendientes() == 1
+    assert gestor.pendientes() == 0
+
+
+def test_comprobante_rechazado_queda_pendiente(archivos, factura):
+    gestor = _gestor(archivos)
+    gestor.emitir(crear_comprobante(factura))
+    # el 102 con otro importe no está grabado: AFIP no lo acepta
+    gestor.emitir(crear_comprobante({**factura, 'total': 242.0, 'neto': 200.0, 'iva': 42.0}))
+
+    assert gestor.informar_pendientes() == 1
+    assert gestor.pendientes() == 1
+
+
+def test_dos_gestores_comparten_pendientes(archivos, factura, monkeypatch):
+    primero, segundo = _gestor(archivos), _gestor(archivos)
+
+    # dos workers con el backend memoria: cada uno con su propia cache
+    numeros = []
+    for gestor in (primero, segundo):
+        monkeypatch.setattr(cache_modulo, '_cache', MemoriaCache())
+        numeros.append(gestor.emitir(crear_comprobante(factura))['cbte_nro'])
+
+    assert numeros == [101, 102]
+    assert primero.pendientes() == segundo.pendientes() == 2
+    assert segundo.informar_pendientes() == 2
+    assert primero.pendientes() == 0
+
+
+def test_numero_indicado_ya_pendiente(archivos, factura):
+    gestor = _gestor(archivos)
+    gestor.emitir(crear_comprobante({**factura, 'nro': 101}))
+
+    with pytest.raises(ValueError, match='pendiente de informar'):
+        _gestor(archivos).emitir(crear_comprobante({**factura, 'nro': 101}))
+
+    assert gestor.pendientes() == 1
+    # el número indicado avanza la numeración local
+    assert gestor.emitir(crear_comprobante(factura))['cbte_nro'] == 102
+
+
+def test_un_solo_informador(archivos, factura):
+    gestor = _gestor(archivos)
+    gestor.emitir(crear_comprobante(factura))
+
+    with open(f'{archivos[1]}.informador.lock', 'a') as informador:
+        fcntl.flock(informador, fcntl.LOCK_EX)
+        assert _gestor(archivos).informar_pendientes() == 0
+
+    assert gestor.pendientes() == 1
+
+
+def test_obtener_caea_solicita_una_sola_vez(archivos):
+    cache, pendientes = archivos
+    fecha = datetime.date(2024, 1, 26)
+
+    obtenido = GestorCAEA(cache=cache, pendientes=pendientes).obtener_caea(fecha)
+
+    assert obtenido['caea'] == CAEA
+    assert (obtenido['periodo'], obtenido['orden']) == (202401, 2)
+    # guardado en la cache: otra instancia no vuelve a llamar a AFIP
+    with open(cache) as f:
+        assert json.load(f)['202401-2']['fch_tope_inf'] == '20240208'
+
+
+def test_facturador_modo_caea(client, factura, archivos, monkeypatch):
+    cache, pendientes = archivos
+    gestor = GestorCAEA(cache=cache, pendientes=pendientes)
+    monkeypatch.setattr(caea, '_gestores', {False: gestor})
+
+    response = client.post('/api/afipws/facturador', json={**factura, 'modo': 'CAEA'})
+
+    assert response.status_code == 200
+    assert response.json['modo'] == 'CAEA'
+    assert response.json['cae'] == CAEA
+    assert response.json['numero_comprobante'] == 101
+    assert gestor.pendientes() == 1
+
+
+def test_pendientes_cerca_de_la_fecha_tope(archivos, factura, monkeypatch, client):
+    gestor = _gestor(archivos)
+    gestor.emitir(crear_comprobante(factura))
+
+    # el CAEA del fixture debe informarse hasta el 20240208
+    assert gestor.controlar_vencimientos(datetime.date(2024, 2, 1))['estado'] == 'ok'
+    assert gestor.controlar_vencimientos(datetime.date(2024, 2, 7)) == {'estado': 'por_vencer', 'vencidos': 0,
+                                                                         'por_vencer': 1}
+    assert gestor.controlar_vencimientos(datetime.date(2024, 2, 9))['estado'] == 'vencido'
+    monkeypatch.setattr(caea, '_gestores', {False: gestor})
+    assert client.get('/api/afipws/health/ready').json['chequeos']['caea']['vencidos'] == 1
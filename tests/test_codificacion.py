@@ -0,0 +1,67 @@
+import gzip
+
+import cbor2
+import msgpack
+import pytest
+import zstandard
+
+from app import codificacion
+
+CONSULTA = '/api/afipws/consulta_comprobante?tipo_cbte=6&punto_vta=4000&cbte_nro=100'
+
+
+@pytest.fixture
+def sin_minimo(monkeypatch):
+    monkeypatch.setattr(codificacion, 'COMPRESION_MINIMA', 0)
+
+
+def test_json_por_defecto(client):
+    response = client.get(CONSULTA)
+
+    assert response.content_type == 'application/json'
+    assert 'Content-Encoding' not in response.headers
+    assert response.json['factura']['cae'] == '74049145150923'
+
+
+@pytest.mark.parametrize('mime, decodificar', [
+    ('application/msgpack', msgpack.unpackb),
+    ('application/cbor', cbor2.loads),
+])
+def test_formatos_compactos(client, mime, decodificar):
+    response = client.get(CONSULTA, headers={'Accept': mime})
+
+    assert response.status_code == 200
+    assert response.content_type == mime
+    assert decodificar(response.data) == client.get(CONSULTA).json
+    assert 'Accept' in response.vary
+
+
+@pytest.mark.parametrize('encoding, descomprimir', [
+    ('gzip', gzip.decompress),
+    ('zstd', lambda data: zstandard.ZstdDecompressor().decompress(data)),
+])
+def test_compresion(client, sin_minimo, encoding, descomprimir):
+    response = client.get(CONSULTA, headers={'Accept-Encoding': encoding, 'Accept': 'application/msgpack'})
+
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.vary
+    assert msgpack.unpackb(descomprimir(response.data))['factura']['cae'] == '74049145150923'
+
+
+def test_zstd_preferido_sobre_gzip(client, sin_minimo):
+    response = client.get(CONSULTA, headers={'Accept-Encoding': 'gzip, zstd'})
+
+    assert response.headers['Content-Encoding'] == 'zstd'
+
+
+def test_respuestas_chicas_sin_comprimir(client):
+    response = client.get(CONSULTA, headers={'Accept-Encoding': 'gzip'})
+
+    assert len(response.data) < codificacion.COMPRESION_MINIMA
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_rutas_de_salud_sin_comprimir(client, sin_minimo):
+    response = client.get('/api/afipws/health/live', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from app import conciliacion
+from app.conciliacion import conciliar
+
+# En AFIP (cassette), tipo 6 y punto de venta 4002: el 5 es posterior al período,
+# el 4 no existe, el 2 tiene otro importe y el 1 otro CAE que el diario local.
+DIARIO = [
+    {'tipo_cbte': 6, 'punto_vta': 4002, 'cbte_nro': 1, 'fecha_cbte': '20240126', 'imp_total': 121.0, 'cae': ''},
+    {'tipo_cbte': 6, 'punto_vta': 4002, 'cbte_nro': 2, 'fecha_cbte': '20240129', 'imp_total': 121.0,
+     'cae': '74049145150002'},
+    {'tipo_cbte': 6, 'punto_vta': 4002, 'cbte_nro': 4, 'fecha_cbte': '20240130', 'imp_total': 121.0,
+     'cae': '74049145150004'},
+]
+
+
+@pytest.fixture
+def archivos(tmp_path, monkeypatch):
+    diario = tmp_path / 'diario.jsonl'
+    diario.write_text(''.join(json.dumps(registro) + '\n' for registro in DIARIO))
+    monkeypatch.setattr(conciliacion, 'DIARIO', str(diario))
+    monkeypatch.setattr(conciliacion, 'ESTADO', str(tmp_path / 'estado.json'))
+    return str(tmp_path / 'estado.json')
+
+
+def _ref(nro):
+    return {'tipo_cbte': 6, 'punto_vta': 4002, 'cbte_nro': nro}
+
+
+def test_compara_contra_afip(archivos):
+    reporte = conciliar('20240101', '20240131', [4002])
+
+    assert reporte['comprobantes_revisados'] == 3
+    assert reporte['ultimos_autorizados'] == {'6-4002': 5}
+    assert reporte['faltantes_local'] == [{**_ref(3), 'imp_total': 121.0, 'cae': '74049145150003'}]
+    assert reporte['faltantes_afip'] == [{**_ref(4), 'imp_total': 121.0, 'cae': '74049145150004'}]
+    assert reporte['diferencias_total'] == [{**_ref(2), 'imp_total_afip': 242.0, 'imp_total_local': 121.0}]
+    assert reporte['sin_cae'] == [{**_ref(1), 'cae_afip': '74049145150001', 'cae_local': ''}]
+    assert reporte['sin_datos_afip'] == [_ref(4)]
+
+
+def test_incremental_no_saltea_comprobantes_posteriores_al_periodo(archivos):
+    conciliar('20240101', '20240131', [4002], incremental=True)
+    # el 5 es del 2 de febrero: queda para la próxima conciliación
+    with open(archivos) as f:
+        assert json.load(f) == {'6-4002': 4}
+
+    reporte = conciliar('20240101', '20240229', [4002], incremental=True)
+
+    assert reporte['faltantes_local'] == [{**_ref(5), 'imp_total': 121.0, 'cae': '74049145150005'}]
+    assert reporte['diferencias_total'] == []
+    with open(archivos) as f:
+        assert json.load(f) == {'6-4002': 5}
+
+
+def test_incremental_no_saltea_comprobantes_anteriores_a_fecha_desde(archivos):
+    with open(archivos, 'w') as f:
+        json.dump({'6-4002': 4}, f)
+
+    # el 5 es del 2 de febrero, anterior al nuevo período
+    reporte = conciliar('20240205', '20240229', [4002], incremental=True)
+
+    assert reporte['faltantes_local'] == [{**_ref(5), 'imp_total': 121.0, 'cae': '74049145150005'}]
+    with open(archivos) as f:
+        assert json.load(f) == {'6-4002': 5}
+
+
+def test_error_de_afip_en_ultimo_autorizado(archivos):
+    with pytest.raises(RuntimeError, match='501'):
+        conciliar('20240101', '20240131', [4003], tipos_cbte=[6])
+
+
+@pytest.mark.parametrize('datos', [
+    {'fecha_desde': '20240101', 'puntos_venta': [4002]},
+    {'fecha_desde': '2024-01-01', 'fecha_hasta': '20240131', 'puntos_venta': [4002]},
+    {'fecha_desde': '20240201', 'fecha_hasta': '20240131', 'puntos_venta': [4002]},
+    {'fecha_desde': '20240101', 'fecha_hasta': '20240131', 'puntos_venta': []},
+    {'fecha_desde': '20240101', 'fecha_hasta': '20240131', 'puntos_venta': ['4002']},
+])
+def test_conciliacion_datos_invalidos(client, datos):
+    response = client.post('/api/afipws/conciliacion', json=datos)
+
+    assert response.status_code == 400
+    assert response.json['error']
+
+
+def test_conciliacion_endpoint(client, archivos):
+    response = client.post('/api/afipws/conciliacion',
+                           json={'fecha_desde': '20240101', 'fecha_hasta': '20240131', 'puntos_venta': [4002]})
+
+    assert response.status_code == 200
+    assert response.json['sin_datos_afip'] == [_ref(4)]
+    assert response.json['faltantes_afip'] == [{**_ref(4), 'imp_total': 121.0, 'cae': '74049145150004'}]
+
+
+def test_conciliacion_error_de_afip(client, archivos):
+    response = client.post('/api/afipws/conciliacion',
+                           json={'fecha_desde': '20240101', 'fecha_hasta': '20240131', 'puntos_venta': [4003],
+                                 'tipos_cbte': [6]})
+
+    assert response.status_code == 500
+    assert response.json['error'].startswith('501:')
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from app import limitador
+from app.factura_electronica import CUIT, bloquear_numeracion
+
+
+@pytest.fixture(autouse=True)
+def buckets(tmp_path, monkeypatch):
+    monkeypatch.setattr(limitador, 'LIMITE_DIRECTORIO', str(tmp_path))
+
+
+def test_facturador_excedido_responde_429(client, factura, monkeypatch):
+    monkeypatch.setenv('LIMITE_TASA_FECAESOLICITAR', '0.1')
+    monkeypatch.setenv('LIMITE_CAPACIDAD_FECAESOLICITAR', '1')
+
+    assert client.post('/api/afipws/facturador', json=factura).json['numero_comprobante'] == 101
+    response = client.post('/api/afipws/facturador', json=factura)
+
+    assert response.status_code == 429
+    assert 5 < int(response.headers['Retry-After']) <= 10
+    assert limitador.metricas()[f'{CUIT}-FECAESolicitar'] == {'admitidas': 1, 'demoradas': 0, 'rechazadas': 1}
+
+
+def test_llamadas_dentro_de_la_admision_no_esperan(client, factura, monkeypatch):
+    # un solo token para FECompUltimoAutorizado, que tardaría mucho en reponerse
+    monkeypatch.setenv('LIMITE_TASA_FECOMPULTIMOAUTORIZADO', '0.001')
+    monkeypatch.setenv('LIMITE_CAPACIDAD_FECOMPULTIMOAUTORIZADO', '1')
+
+    response = client.post('/api/afipws/facturador', json=factura)
+
+    assert response.status_code == 200
+    assert f'{CUIT}-FECompUltimoAutorizado' not in limitador.metricas()
+
+
+@pytest.mark.parametrize('variable, valor', [('LIMITE_TASA_FECOMPCONSULTAR', '0'),
+                                              ('LIMITE_TASA_FECOMPCONSULTAR', '-1'),
+                                              ('LIMITE_CAPACIDAD_FECOMPCONSULTAR', '0.5')])
+def test_configuracion_invalida(monkeypatch, variable, valor):
+    monkeypatch.setenv(variable, valor)
+
+    with pytest.raises(ValueError, match=variable):
+        limitador.adquirir(CUIT, 'FECompConsultar')
+
+
+def test_cliente_limitado_fuera_de_una_admision(monkeypatch):
+    monkeypatch.setenv('LIMITE_TASA_FECOMPCONSULTAR', '0.1')
+    monkeypatch.setenv('LIMITE_CAPACIDAD_FECOMPCONSULTAR', '1')
+    cliente = limitador.ClienteLimitado(type('Cliente', (), {'CompConsultar': lambda self, *a: True})(), CUIT)
+
+    assert cliente.CompConsultar(6, 4000, 1)
+    with pytest.raises(limitador.LimiteExcedido) as error:
+        cliente.CompConsultar(6, 4000, 1)
+
+    assert error.value.operacion == 'FECompConsultar'
+    assert error.value.retry_after > limitador.LIMITE_ESPERA_MAXIMA
+
+
+def test_numeracion_ocupada_responde_429_dentro_de_la_espera(client, factura, monkeypatch):
+    monkeypatch.setattr(limitador, 'LIMITE_ESPERA_MAXIMA', 0.2)
+
+    # otro worker está autorizando en el mismo punto de venta
+    with bloquear_numeracion(6, 4000):
+        inicio = time.monotonic()
+        response = client.post('/api/afipws/facturador', json=factura)
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert time.monotonic() - inicio < 1
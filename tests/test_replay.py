@@ -0,0 +1,192 @@
+import time
+
+import pytest
+
+from app.factura_electronica import (autenticar, conectar_wsfev1, consultar_comprobante, Comprobante,
+                                     crear_comprobante, _pyafipws)
+from app.replay import Cassette, ClienteReplay, clientes_grabadores
+from conftest import CASSETTES
+
+
+def test_facturador_autoriza_con_cae(client, factura):
+    response = client.post('/api/afipws/facturador', json=factura)
+
+    assert response.status_code == 200
+    assert response.json['cae'] == '74049145150923'
+    assert response.json['vencimiento_cae'] == '20240205'
+    assert response.json['resultado'] == 'A'
+    assert response.json['numero_comprobante'] == 101
+    assert response.json['modo'] == 'CAE'
+
+
+def test_facturador_sin_campos_requeridos(client, factura):
+    del factura['id_condicion_iva']
+
+    response = client.post('/api/afipws/facturador', json=factura)
+
+    assert response.status_code == 400
+
+
+def test_solicitudes_invalidas_no_abren_el_corte(app, client, factura):
+    from app import salud
+
+    del factura['documento']
+    for _ in range(salud.SALUD_UMBRAL_FALLAS + 1):
+        assert client.post('/api/afipws/facturador', json=factura).status_code == 400
+        assert client.post('/api/afipws/conciliacion', json={}).status_code == 400
+    salud.monitor.sondear()
+    response = client.get('/api/afipws/health/ready')
+
+    assert response.status_code == 200
+    assert response.json['chequeos']['corte'] == {'estado': 'cerrado', 'fallas_consecutivas': 0}
+
+
+def test_tipos_invalidos_no_abren_el_corte(client, factura, monkeypatch):
+    from app import salud, routes
+
+    with pytest.raises(ValueError, match="'total', 'iva'"):
+        crear_comprobante({**factura, 'total': 'abc', 'iva': '21', 'neto': None})
+    for _ in range(salud.SALUD_UMBRAL_FALLAS):
+        assert client.post('/api/afipws/facturador', json={**factura, 'total': 'abc'}).status_code == 400
+    # un error propio del servicio tampoco es una falla de AFIP
+    monkeypatch.setattr(routes, 'facturar', lambda json_data, production: None + 1)
+    assert client.post('/api/afipws/facturador', json=factura).status_code == 500
+    salud.monitor.sondear()
+    response = client.get('/api/afipws/health/ready')
+
+    assert response.status_code == 200
+    assert response.json['chequeos']['corte'] == {'estado': 'cerrado', 'fallas_consecutivas': 0}
+
+
+def test_facturador_comprobante_distinto_al_grabado(client, factura):
+    factura_grabada = dict(factura)
+    factura.update(total=242.0, neto=200.0, iva=42.0)
+
+    response = client.post('/api/afipws/facturador', json=factura)
+
+    assert response.status_code == 500
+    # el número no se consumió: la próxima factura vuelve a ser la 101
+    assert client.post('/api/afipws/facturador', json=factura_grabada).json['numero_comprobante'] == 101
+
+
+def test_consulta_comprobante_encontrado(client):
+    response = client.get('/api/afipws/consulta_comprobante?tipo_cbte=6&punto_vta=4000&cbte_nro=100')
+
+    assert response.status_code == 200
+    assert response.json['mensaje'] == 'Comprobante encontrado.'
+    assert response.json['factura']['cae'] == '74049145150923'
+    assert response.json['factura']['imp_total'] == 121.0
+
+
+def test_consulta_comprobante_inexistente(client):
+    response = client.get('/api/afipws/consulta_comprobante?tipo_cbte=6&punto_vta=4000&cbte_nro=999')
+
+    assert response.status_code == 200
+    assert response.json['mensaje'].startswith('602:')
+    assert response.json['factura'] is None
+
+
+def test_consultar_comprobante_limpia_error_anterior():
+    assert consultar_comprobante(6, 4000, 999)['factura'] is None
+    assert consultar_comprobante(6, 4000, 100)['factura']['cbt_desde'] == 100
+
+
+def test_comprobante_autorizar_autonumera():
+    wsfev1 = conectar_wsfev1(autenticar())
+    cbte = Comprobante(tipo_cbte=6, punto_vta=4000, fecha_cbte='20240126', tipo_doc=96,
+                       nro_doc='22222222', imp_total=121.0, imp_neto=100.0, imp_iva=21.0)
+    cbte.agregar_iva(5, 100.0, 21.0)
+
+    assert cbte.autorizar(wsfev1)
+    assert cbte.encabezado['cbte_nro'] == 101
+    assert cbte.encabezado['cae'] == '74049145150923'
+
+
+def test_readiness_con_afip_disponible(app, client):
+    from app import salud
+
+    salud.monitor.sondear()
+    response = client.get('/api/afipws/health/ready')
+
+    assert response.status_code == 200
+    assert response.json['chequeos']['afip']['estado'] == 'ok'
+
+
+def test_excepcion_propagada_libera_la_solicitud(app):
+    from app import salud
+
+    contexto = app.test_request_context('/api/afipws/facturador', method='POST')
+    contexto.push()
+    app.preprocess_request()
+    en_curso = salud.monitor.readiness()[1]['chequeos']['solicitudes']['en_curso']
+    # la excepción se propaga: after_request no se ejecuta
+    contexto.pop(ConnectionRefusedError('AFIP no responde'))
+
+    chequeos = salud.monitor.readiness()[1]['chequeos']
+    assert chequeos['solicitudes']['en_curso'] == en_curso - 1
+    assert chequeos['corte']['fallas_consecutivas'] == 1
+    salud.monitor.registrar_resultado(200)
+
+
+def test_latencia_inyectada():
+    cassette = Cassette(f'{CASSETTES}/wsfev1_homologacion.json', latencia_ms=50)
+    wsfev1 = ClienteReplay('wsfev1', cassette)
+
+    inicio = time.monotonic()
+    assert wsfev1.CompUltimoAutorizado(6, 4000) == '100'
+    assert time.monotonic() - inicio >= 0.05
+
+
+def test_interaccion_no_grabada():
+    cassette = Cassette(f'{CASSETTES}/wsfev1_homologacion.json')
+    wsfev1 = ClienteReplay('wsfev1', cassette)
+
+    with pytest.raises(RuntimeError, match='Interacción no grabada'):
+        wsfev1.CompUltimoAutorizado(1, 1)
+
+
+class _WSFEv1Real:
+    """Cliente con la interfaz de pyafipws que autoriza cualquier comprobante."""
+
+    ErrMsg = ''
+
+    def CrearFactura(self, **encabezado):
+        self.cbte_nro = encabezado['cbt_desde']
+
+    def AgregarIva(self, **iva):
+        pass
+
+    def CAESolicitar(self):
+        self.Resultado, self.CAE = 'A', f'7404914515{self.cbte_nro:04d}'
+        return self.CAE
+
+
+def test_grabar_y_reproducir_por_comprobante(tmp_path):
+    path = str(tmp_path / 'cassette.json')
+    _, WSFEv1 = clientes_grabadores(None, _WSFEv1Real, path)
+    grabador = WSFEv1()
+    for nro in (101, 102):
+        grabador.CrearFactura(tipo_cbte=6, punto_vta=4000, cbt_desde=nro, cbt_hasta=nro, fecha_cbte='20240126')
+        grabador.AgregarIva(iva_id=5, base_imp=100.0, importe=21.0)
+        grabador.CAESolicitar()
+
+    wsfev1 = ClienteReplay('wsfev1', Cassette(path))
+    # la fecha del día no forma parte de la clave
+    wsfev1.CrearFactura(tipo_cbte=6, punto_vta=4000, cbt_desde=102, cbt_hasta=102, fecha_cbte='20991231')
+    wsfev1.AgregarIva(iva_id=5, base_imp=100.0, importe=21.0)
+    assert wsfev1.CAESolicitar() == '74049145150102'
+    wsfev1.CrearFactura(tipo_cbte=6, punto_vta=4000, cbt_desde=102, cbt_hasta=102)
+    wsfev1.AgregarIva(iva_id=5, base_imp=200.0, importe=42.0)
+    with pytest.raises(RuntimeError, match='Interacción no grabada'):
+        wsfev1.CAESolicitar()
+
+
+def test_replay_no_se_admite_en_produccion(app):
+    from app.service import create_app, load_config
+
+    with pytest.raises(RuntimeError):
+        _pyafipws(production=True)
+    with pytest.raises(RuntimeError):
+        conectar_wsfev1(None, production=True)
+    with pytest.raises(RuntimeError):
+        create_app({**load_config(), 'production': True})